@@ -0,0 +1,279 @@
+"""Measure the overhead of the report plugin for synthetic test suites
+
+Every configuration runs in a separate process, which feeds fabricated
+``TestReport`` objects to ``LogJunitXrayXml`` the way pytest does and writes
+the report. For each configuration the wall time, the peak RSS and the size
+of the report are recorded.
+
+Examples::
+
+    python benchmarks/bench_report.py --output before.json
+    python benchmarks/bench_report.py --tests 1000 100000 --evidences 0 5 \
+        --evidence-size 102400 --output after.json --compare before.json
+    python benchmarks/bench_report.py --preset encoding \
+        --encoding-workers 0 8 16
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+PRESETS = {
+    "quick": dict(
+        tests=[1000],
+        evidences=[0, 2],
+        evidence_size=[1024],
+        description_size=[0, 1024],
+        output_size=[0, 4096],
+        streaming=[False, True],
+        serializer=["direct"],
+        encoding_workers=[0],
+    ),
+    "full": dict(
+        tests=[1000, 10000, 100000],
+        evidences=[0, 1, 5],
+        evidence_size=[1024, 102400],
+        description_size=[0, 4096],
+        output_size=[0, 65536],
+        streaming=[False, True],
+        serializer=["direct"],
+        encoding_workers=[0],
+    ),
+    # evidence of one and of several chunks for the encoding processes;
+    # only meaningful on a machine with several cores
+    "encoding": dict(
+        tests=[50],
+        evidences=[2],
+        evidence_size=[1024 * 1024, 16 * 1024 * 1024],
+        description_size=[0],
+        output_size=[0],
+        streaming=[True],
+        serializer=["direct"],
+        encoding_workers=[0, 2, 4],
+    ),
+}
+MEASUREMENTS = ("wall_time", "peak_rss_kib", "output_bytes")
+
+
+def _make_reports(configuration: dict):
+    from _pytest.reports import TestReport
+
+    description = "d" * configuration["description_size"]
+    captured_output = "o" * configuration["output_size"]
+    for index_ in range(configuration["tests"]):
+        nodeid = f"tests/test_synthetic.py::test_{index_}"
+        location = ("tests/test_synthetic.py", index_, f"test_{index_}")
+        failed = index_ % 10 == 0
+        for when_ in ("setup", "call", "teardown"):
+            if when_ == "call":
+                sections = [("Captured stdout call", captured_output)]
+                user_properties = [
+                    ("test_key", f"JIRA-{index_}"),
+                    ("test_summary", f"Synthetic test {index_}"),
+                ]
+                if description:
+                    user_properties.append(("test_description", description))
+                user_properties.extend(
+                    ("test_evidence", evidence_)
+                    for evidence_ in _make_evidences(configuration, index_)
+                )
+                outcome = "failed" if failed else "passed"
+                longrepr = "assert False" if failed else None
+            else:
+                sections = []
+                user_properties = []
+                outcome = "passed"
+                longrepr = None
+            report = TestReport(
+                nodeid=nodeid,
+                location=location,
+                keywords={},
+                outcome=outcome,
+                longrepr=longrepr,
+                when=when_,
+                sections=sections,
+                duration=0.001,
+                user_properties=user_properties,
+            )
+            yield report
+
+
+def _make_evidences(configuration: dict, index: int):
+    from pytest_junit_xray_xml.evidence import SpooledEvidence
+
+    for evidence_index_ in range(configuration["evidences"]):
+        evidence = SpooledEvidence(f"evidence{evidence_index_}.bin")
+        evidence.write(
+            index.to_bytes(8, "little") * (configuration["evidence_size"] // 8)
+        )
+        evidence.close()
+        yield evidence
+
+
+def run_configuration(configuration: dict) -> dict:
+    """Run a single configuration in the current process
+
+    The wall time includes starting the encoding processes, if any.
+    """
+    from pytest_junit_xray_xml.junit_xml_xray_xml import LogJunitXrayXml
+
+    with tempfile.TemporaryDirectory() as directory:
+        xmlfile = os.path.join(directory, "report.xml")
+        start_time = time.perf_counter()
+        log = LogJunitXrayXml(
+            xmlfile,
+            family="xray",
+            logging="all" if configuration["output_size"] else "no",
+            streaming=configuration["streaming"],
+            serializer=configuration["serializer"],
+            encoding_workers=configuration["encoding_workers"],
+        )
+        log.pytest_sessionstart()
+        for report_ in _make_reports(configuration):
+            log.pytest_runtest_logreport(report_)
+        log.pytest_sessionfinish()
+        wall_time = time.perf_counter() - start_time
+        output_bytes = os.path.getsize(xmlfile)
+    result = dict(
+        configuration,
+        wall_time=wall_time,
+        peak_rss_kib=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        output_bytes=output_bytes,
+    )
+    return result
+
+
+def _get_configurations(arguments: argparse.Namespace) -> list[dict]:
+    dimensions = dict(PRESETS[arguments.preset])
+    for name_ in dimensions:
+        value = getattr(arguments, name_)
+        if value is not None:
+            dimensions[name_] = value
+    result = [
+        dict(zip(dimensions, values_))
+        for values_ in itertools.product(*dimensions.values())
+    ]
+    return result
+
+
+def _get_commit() -> str:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        result = None
+    return result
+
+
+def _get_key(result: dict) -> tuple:
+    return tuple(
+        (name_, value_)
+        for name_, value_ in sorted(result.items())
+        if name_ not in MEASUREMENTS
+    )
+
+
+def _print_results(results: list[dict], baseline: dict) -> None:
+    for result_ in results:
+        configuration = ", ".join(
+            f"{name_}={value_}" for name_, value_ in _get_key(result_)
+        )
+        measurements = []
+        for name_ in MEASUREMENTS:
+            value = result_[name_]
+            text = f"{name_}={value:.3f}" if isinstance(value, float) \
+                else f"{name_}={value}"
+            reference = baseline.get(_get_key(result_))
+            if reference and reference[name_]:
+                text += f" ({value / reference[name_]:.2f}x)"
+            measurements.append(text)
+        print(f"{configuration}\n    {', '.join(measurements)}")
+
+
+def main(argv: list[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--tests", type=int, nargs="+")
+    parser.add_argument("--evidences", type=int, nargs="+")
+    parser.add_argument("--evidence-size", type=int, nargs="+")
+    parser.add_argument("--description-size", type=int, nargs="+")
+    parser.add_argument("--output-size", type=int, nargs="+")
+    parser.add_argument(
+        "--streaming",
+        type=lambda value: value.lower() in ("1", "true", "yes"),
+        nargs="+"
+    )
+    parser.add_argument(
+        "--serializer", choices=["direct", "etree", "lxml"], nargs="+"
+    )
+    parser.add_argument(
+        "--encoding-workers", type=int, nargs="+",
+        help="numbers of processes base64-encoding the evidence, 0 to "
+             "encode it in the writing thread"
+    )
+    parser.add_argument(
+        "--output", help="write the results as JSON to this file"
+    )
+    parser.add_argument(
+        "--compare", help="JSON file of an earlier run to compare against"
+    )
+    parser.add_argument("--run-configuration", help=argparse.SUPPRESS)
+    arguments = parser.parse_args(argv)
+
+    if arguments.run_configuration:
+        result = run_configuration(json.loads(arguments.run_configuration))
+        print(json.dumps(result))
+        return
+
+    results = []
+    for configuration_ in _get_configurations(arguments):
+        # a fresh process per configuration, so that peak RSS is meaningful
+        completed_process = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--run-configuration",
+                json.dumps(configuration_),
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        results.append(json.loads(completed_process.stdout))
+
+    baseline = {}
+    if arguments.compare:
+        with open(arguments.compare, encoding="UTF-8") as compare_file:
+            baseline = {
+                _get_key(result_): result_
+                for result_ in json.load(compare_file)["results"]
+            }
+    _print_results(results, baseline)
+    if arguments.output:
+        with open(arguments.output, "w", encoding="UTF-8") as output_file:
+            json.dump(
+                {
+                    "commit": _get_commit(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpus": os.cpu_count(),
+                    "results": results,
+                },
+                output_file,
+                indent=4,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,23 @@
-from .fixtures import (
-    record_test_summary,
-    record_test_id,
-    record_test_description,
-    record_test_key,
-    record_test_evidence
-)
+import importlib
 
 __all__ = [
     "record_test_summary",
     "record_test_id",
     "record_test_description",
     "record_test_key",
-    "record_test_evidence"
-]
\ No newline at end of file
+    "record_test_evidence",
+    "record_test_evidence_file"
+]
+
+
+def __getattr__(name: str):
+    # the fixtures are imported on first use, so that loading the plugin
+    # stays cheap for pytest runs without a report
+    if name in __all__:
+        fixtures = importlib.import_module(".fixtures", __name__)
+        result = getattr(fixtures, name)
+    else:
+        raise AttributeError(
+            f"module '{__name__}' has no attribute '{name}'"
+        )
+    return result
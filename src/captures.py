@@ -0,0 +1,130 @@
+import os
+import tempfile
+import typing
+import weakref
+
+from .defaults import DEFAULT_SPOOL_SIZE
+from .evidence import _remove_file
+
+
+# characters, not bytes, since captured output is text
+TEXT_CHUNK_SIZE = 64 * 1024
+
+
+class SpooledText(object):
+    """Captured output which has been moved to a temporary file
+
+    The text is streamed into the report chunk by chunk, see
+    :meth:`iter_text`.
+    """
+    def __init__(self, pieces: typing.Iterable[str]) -> None:
+        file_descriptor, self.path = tempfile.mkstemp(
+            prefix="junit-xray-output-"
+        )
+        weakref.finalize(self, _remove_file, self.path)
+        self.size = 0
+        with os.fdopen(file_descriptor, "w", encoding="UTF-8",
+                       errors="surrogatepass", newline="") as spool_file:
+            for piece_ in pieces:
+                self.size += spool_file.write(piece_)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(size={self.size})"
+
+    def __str__(self) -> str:
+        return "".join(self.iter_text())
+
+    def __len__(self) -> int:
+        return self.size
+
+    def iter_text(self, chunk_size: int = TEXT_CHUNK_SIZE
+                  ) -> typing.Iterator[str]:
+        with open(self.path, encoding="UTF-8", errors="surrogatepass",
+                  newline="") as spool_file:
+            while True:
+                chunk = spool_file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+CapturedText = typing.Union[str, SpooledText]
+
+
+def _get_head(pieces: list[str], size: int) -> list[str]:
+    result = []
+    for piece_ in pieces:
+        if size <= 0:
+            break
+        result.append(piece_[:size])
+        size -= len(piece_)
+    return result
+
+
+def _get_tail(pieces: list[str], size: int) -> list[str]:
+    result = []
+    for piece_ in reversed(pieces):
+        if size <= 0:
+            break
+        result.append(piece_[-size:])
+        size -= len(piece_)
+    result.reverse()
+    return result
+
+
+class OutputLimiter(object):
+    """Bounds the captured output kept for the report
+
+    :param limit: maximum number of characters of ``system-out`` or
+        ``system-err`` of a testcase, ``None`` for no limit
+    :param run_limit: maximum number of characters of captured output of the
+        whole session, ``None`` for no limit
+    :param spool_size: captured output above this number of characters is
+        moved to a temporary file
+
+    Output beyond a limit is cut out of the middle, so that its head and tail
+    are kept, and replaced by a truncation marker.
+    """
+    def __init__(self, limit: typing.Optional[int] = None,
+                 run_limit: typing.Optional[int] = None,
+                 spool_size: int = DEFAULT_SPOOL_SIZE) -> None:
+        self.limit = limit
+        self.run_limit = run_limit
+        self.spool_size = spool_size
+        self.remaining = run_limit
+
+    def _get_limit(self) -> typing.Optional[int]:
+        if self.remaining is None:
+            result = self.limit
+        elif self.limit is None:
+            result = max(self.remaining, 0)
+        else:
+            result = max(min(self.limit, self.remaining), 0)
+        return result
+
+    def make_text(self, sections: list[tuple[str, str]]) -> CapturedText:
+        """``system-out`` or ``system-err`` of the captured sections
+
+        :param sections: ``(header, content)`` tuples
+        """
+        pieces = []
+        for header_, content_ in sections:
+            pieces.extend((header_.center(80, "-"), "\n", content_, "\n"))
+        size = sum(map(len, pieces))
+        limit = self._get_limit()
+        if limit is not None and size > limit:
+            omitted = size - limit
+            marker = f"\n[... {omitted} characters truncated ...]\n"
+            pieces = (
+                _get_head(pieces, limit - limit // 2)
+                + [marker]
+                + _get_tail(pieces, limit // 2)
+            )
+            size = limit
+        if self.remaining is not None:
+            self.remaining -= size
+        if size > self.spool_size:
+            result = SpooledText(pieces)
+        else:
+            result = "".join(pieces)
+        return result
@@ -0,0 +1,125 @@
+import gzip
+import os
+import typing
+
+
+COMPRESSIONS = ("auto", "none", "gzip", "zstd")
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+# level 9, the default of gzip, is several times slower for little gain
+DEFAULT_GZIP_LEVEL = 6
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def get_compression(xmlfile: str, compression: str = "auto") -> str:
+    """
+    :param compression: one of auto|none|gzip|zstd, ``auto`` selects the
+        compression by the extension of ``xmlfile``
+    :return: one of none|gzip|zstd
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(
+            f"Unknown compression '{compression}', expected one of "
+            f"{'|'.join(COMPRESSIONS)}"
+        )
+    if compression == "auto":
+        _, extension = os.path.splitext(xmlfile)
+        result = COMPRESSION_EXTENSIONS.get(extension.lower(), "none")
+    else:
+        result = compression
+    return result
+
+
+def split_extension(xmlfile: str) -> tuple[str, str]:
+    """``report.xml.gz`` -> ``("report", ".xml.gz")``"""
+    root, extension = os.path.splitext(xmlfile)
+    if extension.lower() in COMPRESSION_EXTENSIONS:
+        root, inner_extension = os.path.splitext(root)
+        extension = inner_extension + extension
+    result = (root, extension)
+    return result
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError as exception:
+        raise ImportError(
+            "zstd compression requires zstandard: "
+            "python -m pip install zstandard"
+        ) from exception
+    return zstandard
+
+
+def _get_zstd_compressor(level: typing.Optional[int] = None):
+    zstandard = _import_zstandard()
+    if level is None:
+        result = zstandard.ZstdCompressor()
+    else:
+        result = zstandard.ZstdCompressor(level=level)
+    return result
+
+
+def open_output(path: str, compression: str = "none",
+                level: typing.Optional[int] = None,
+                mode: str = "wb") -> typing.BinaryIO:
+    """Open ``path`` for writing through a streaming compressor
+
+    :param compression: one of none|gzip|zstd
+    :param level: compression level, the default of the compressor if
+        ``None``
+    :param mode: ``ab`` appends a new gzip member or zstd frame
+    """
+    if compression == "none":
+        result = open(path, mode)
+    elif compression == "gzip":
+        result = gzip.open(
+            path, mode, DEFAULT_GZIP_LEVEL if level is None else level
+        )
+    elif compression == "zstd":
+        result = _get_zstd_compressor(level).stream_writer(
+            open(path, mode), closefd=True
+        )
+    else:
+        raise ValueError(f"Unknown compression '{compression}'")
+    return result
+
+
+def compress(data: bytes, compression: str = "none",
+             level: typing.Optional[int] = None) -> bytes:
+    """``data`` as a gzip member or zstd frame of its own
+
+    Concatenated gzip members, or zstd frames, decompress to the
+    concatenated data, so parts of a report can be compressed separately.
+    """
+    if compression == "none":
+        result = data
+    elif compression == "gzip":
+        result = gzip.compress(
+            data, DEFAULT_GZIP_LEVEL if level is None else level
+        )
+    elif compression == "zstd":
+        result = _get_zstd_compressor(level).compress(data)
+    else:
+        raise ValueError(f"Unknown compression '{compression}'")
+    return result
+
+
+def open_input(path: str) -> typing.BinaryIO:
+    """Open a report for reading, decompressing it if necessary
+
+    The compression is detected from the first bytes of the file. A file of
+    several gzip members or zstd frames is read as a whole.
+    """
+    with open(path, "rb") as input_file:
+        magic = input_file.read(len(ZSTD_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        result = gzip.open(path, "rb")
+    elif magic == ZSTD_MAGIC:
+        zstandard = _import_zstandard()
+        result = zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), closefd=True, read_across_frames=True
+        )
+    else:
+        result = open(path, "rb")
+    return result
@@ -0,0 +1,6 @@
+# Kept free of imports, so that the plugin can register its options without
+# loading the report machinery.
+DEFAULT_SPOOL_SIZE = 1024 * 1024
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_EVIDENCE_WORKERS = 4
@@ -0,0 +1,89 @@
+import pytest
+
+from _pytest.reports import TestReport
+
+from .junit_xml_xray_xml import LogJunitXrayXml
+from .writers import FragmentWriter, MergingWriter, ThreadedWriter
+
+
+def _check_options(plugin: LogJunitXrayXml) -> None:
+    if plugin.report_format == "json":
+        raise pytest.UsageError(
+            "The Xray JSON format is not supported together with pytest-xdist"
+        )
+    if plugin.is_sharded:
+        raise pytest.UsageError(
+            "Sharded reports are not supported together with pytest-xdist"
+        )
+
+
+class LogJunitXrayXmlWorker(LogJunitXrayXml):
+    """Writes the testcases of a pytest-xdist worker to a part file
+
+    The part file, together with the counters, is handed to the controller
+    through ``workeroutput``, so neither testcases nor encoded evidence have
+    to travel through execnet.
+    """
+    def __init__(self, workeroutput: dict, worker_id: str, *args,
+                 **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        _check_options(self)
+        self.workeroutput = workeroutput
+        # the measurements are reported by the controller
+        self.profile_file = None
+        # compressed like the report, see write_report
+        self.fragment_writer = FragmentWriter(
+            f"{self.xmlfile}.{worker_id}.part", self.serializer,
+            self.compression, self.compression_level
+        )
+        if isinstance(self.writer, ThreadedWriter):
+            self.writer.writer = self.fragment_writer
+        else:
+            self.writer = self.fragment_writer
+
+    def pytest_sessionfinish(self) -> None:
+        self._finish_pending_tests()
+        with self.profiler.measure("write_report"):
+            self.writer.close()
+        self._close_encoder()
+        self._finish_profile(self.fragment_writer.size)
+        self.workeroutput["junit_xray"] = {
+            "body_file_name": self.fragment_writer.body_file_name,
+            "number_of_testcases": self.fragment_writer.number_of_testcases,
+            "stats": self.stats.to_dict(),
+            "profile": self.profiler.to_dict(),
+            "slowest": None if self.slowest is None
+            else self.slowest.to_dict(),
+        }
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        # registered after WorkerEvidenceNames, so it still gets the
+        # recorded evidence, see pytest_configure of the plugin
+        super().pytest_runtest_logreport(report)
+
+
+class LogJunitXrayXmlController(LogJunitXrayXml):
+    """Merges the part files of all pytest-xdist workers into the report"""
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        _check_options(self)
+        self.writer = MergingWriter(
+            self.report_file, self.serializer.space, self.compression,
+            self.compression_level
+        )
+
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        # the testcases are written by the workers
+        pass
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error) -> None:
+        workeroutput = getattr(node, "workeroutput", {}).get("junit_xray")
+        if workeroutput is not None:
+            self.stats.update(workeroutput["stats"])
+            self.profiler.update(workeroutput["profile"])
+            if self.slowest is not None:
+                self.slowest.update(workeroutput["slowest"])
+            if workeroutput["number_of_testcases"]:
+                self.writer.add_body_file(workeroutput["body_file_name"])
@@ -0,0 +1,229 @@
+import base64
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import typing
+
+from .evidence import EVIDENCE_CHUNK_SIZE, BaseEvidence, DeferredEvidence
+from .exceptions import EvidenceError
+
+
+# larger than the chunks of the serial encoding, so that a chunk is worth
+# sending to another process; a multiple of 3 as well
+PARALLEL_CHUNK_SIZE = 16 * EVIDENCE_CHUNK_SIZE
+
+
+def _get_start_method() -> str:
+    # forking a process with running threads, e.g. the writer thread or the
+    # threads producing evidence, may deadlock
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        result = "forkserver"
+    else:
+        result = "spawn"
+    return result
+
+
+def _encode_file_range(path: str, offset: int, size: int) -> bytes:
+    with open(path, "rb") as evidence_file:
+        evidence_file.seek(offset)
+        result = base64.b64encode(evidence_file.read(size))
+    return result
+
+
+class _QueuedEvidence(object):
+    """Test evidence whose chunks are submitted to a :class:`ParallelEncoder`
+    ahead of its writing"""
+    def __init__(self, evidence: BaseEvidence) -> None:
+        self.evidence = evidence
+        # created once the evidence is ready, see ParallelEncoder._submit
+        self.tasks = None
+        self.futures = collections.deque()
+        self.is_submitted = False
+        self.is_discarded = False
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(evidence={self.evidence!r}, "
+            f"futures={len(self.futures)})"
+        )
+
+
+class ParallelEncoder(object):
+    """Base64-encodes test evidence on a pool of processes
+
+    Evidence is queued with :meth:`add` when its testcase is recorded. The
+    chunks of all queued evidence, across items and testcases, are encoded
+    by up to ``workers`` processes at the same time, while at most
+    ``window`` encoded chunks are waiting to be written, so the memory stays
+    bounded. :meth:`iter_base64` yields the chunks of one evidence in their
+    original order, i.e. the report is the same as with serial encoding.
+    Evidence written out of order, or never queued, is moved to the front;
+    evidence queued before it is given up, since it is not written in turn,
+    e.g. duplicates of cached evidence, and is encoded anew if it still is.
+    Evidence held in a file is read by the processes themselves, so only the
+    encoded chunks are sent between processes. Processes are used, not
+    threads, since base64 encoding holds the GIL; they are not forked, see
+    :func:`_get_start_method`.
+    """
+    def __init__(self, workers: int,
+                 window: typing.Optional[int] = None,
+                 chunk_size: int = PARALLEL_CHUNK_SIZE) -> None:
+        self.workers = workers
+        self.window = window or 2 * workers
+        self.chunk_size = chunk_size
+        self._executor = None
+        # evidence is queued while the tests run and written by the writer
+        # thread, if any
+        self._queue = collections.OrderedDict()
+        self._unsubmitted = collections.deque()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(workers={self.workers}, "
+            f"window={self.window})"
+        )
+
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        # the processes are only started once evidence is queued
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(_get_start_method())
+            )
+        return self._executor
+
+    def _iter_tasks(self, evidence: BaseEvidence) -> typing.Iterator[tuple]:
+        path = evidence.get_path()
+        if path is None:
+            for chunk_ in evidence.iter_chunks(self.chunk_size):
+                yield (base64.b64encode, chunk_)
+        else:
+            for offset_ in range(0, os.path.getsize(path), self.chunk_size):
+                yield (_encode_file_range, path, offset_, self.chunk_size)
+
+    def _submit_next(self, queued: _QueuedEvidence) -> bool:
+        """Submit the next chunk of ``queued``, False if there is none"""
+        if queued.tasks is None:
+            queued.tasks = self._iter_tasks(queued.evidence)
+        task = next(queued.tasks, None)
+        if task is None:
+            queued.is_submitted = True
+            return False
+        queued.futures.append(self._get_executor().submit(*task))
+        self._pending += 1
+        return True
+
+    def _submit(self) -> None:
+        # called under the lock
+        while self._pending < self.window and self._unsubmitted:
+            queued = self._unsubmitted[0]
+            if queued.is_discarded or queued.is_submitted:
+                self._unsubmitted.popleft()
+                continue
+            if isinstance(queued.evidence, DeferredEvidence) \
+                    and not queued.evidence.is_done():
+                # deferred evidence which is not produced yet is not waited
+                # for here, but when its testcase is written
+                break
+            try:
+                self._submit_next(queued)
+            except (EvidenceError, OSError):
+                # raised again when the evidence is written, if it still is
+                self._discard(queued)
+                queued.tasks = None
+
+    def _discard(self, queued: _QueuedEvidence) -> None:
+        queued.is_discarded = True
+        for future_ in queued.futures:
+            future_.cancel()
+        self._pending -= len(queued.futures)
+        queued.futures.clear()
+
+    def add(self, evidence: BaseEvidence) -> None:
+        """Queue ``evidence`` to be encoded ahead of :meth:`iter_base64`"""
+        with self._lock:
+            if evidence not in self._queue:
+                queued = _QueuedEvidence(evidence)
+                self._queue[evidence] = queued
+                self._unsubmitted.append(queued)
+            self._submit()
+
+    def _dequeue(self, evidence: BaseEvidence) -> _QueuedEvidence:
+        # called under the lock
+        queued = self._queue.get(evidence)
+        if queued is None:
+            queued = _QueuedEvidence(evidence)
+        else:
+            while True:
+                evidence_, queued_ = self._queue.popitem(last=False)
+                if evidence_ is evidence:
+                    break
+                self._discard(queued_)
+        if not queued.is_submitted:
+            self._unsubmitted.appendleft(queued)
+        return queued
+
+    def iter_base64(self, evidence: BaseEvidence) -> typing.Iterator[bytes]:
+        with self._lock:
+            queued = self._dequeue(evidence)
+            self._submit()
+        try:
+            while True:
+                with self._lock:
+                    if not queued.futures and (
+                        queued.is_submitted or not self._submit_next(queued)
+                    ):
+                        break
+                    future = queued.futures.popleft()
+                    self._pending -= 1
+                    self._submit()
+                yield future.result()
+        finally:
+            with self._lock:
+                self._discard(queued)
+                self._submit()
+
+    def close(self) -> None:
+        with self._lock:
+            for queued_ in self._queue.values():
+                self._discard(queued_)
+            self._queue.clear()
+            self._unsubmitted.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class ParallelEvidence(BaseEvidence):
+    """Test evidence which is base64-encoded by a :class:`ParallelEncoder`"""
+    def __init__(self, evidence: BaseEvidence,
+                 encoder: ParallelEncoder) -> None:
+        self.evidence = evidence
+        self.filename = evidence.filename
+        self.encoder = encoder
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(evidence={self.evidence!r})"
+
+    def iter_chunks(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        return self.evidence.iter_chunks(chunk_size)
+
+    def queue(self) -> None:
+        """Encode ahead, see :meth:`ParallelEncoder.add`"""
+        self.encoder.add(self.evidence)
+
+    def iter_base64(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        # the encoder chooses its own chunk size
+        return self.encoder.iter_base64(self.evidence)
+
+    def check(self) -> None:
+        self.evidence.check()
+
+    def digest(self) -> str:
+        return self.evidence.digest()
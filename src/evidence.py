@@ -0,0 +1,370 @@
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import threading
+import typing
+import weakref
+
+from .defaults import DEFAULT_CACHE_SIZE, DEFAULT_SPOOL_SIZE
+from .exceptions import EvidenceError
+
+
+# a multiple of 3, so that the encoded chunks can simply be concatenated
+EVIDENCE_CHUNK_SIZE = 3 * 64 * 1024
+DEDUPLICATION_POLICIES = ("no", "cache", "once")
+
+
+def _remove_file(path: str) -> None:
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def iter_stream_chunks(stream: typing.BinaryIO,
+                       chunk_size: int = EVIDENCE_CHUNK_SIZE
+                       ) -> typing.Iterator[bytes]:
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class BaseEvidence(object):
+    """Test evidence whose content is read chunk by chunk
+
+    Subclasses provide ``filename`` and :meth:`iter_chunks`.
+    """
+    filename = None
+
+    def iter_chunks(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        raise NotImplementedError()
+
+    def iter_base64(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        for chunk_ in self.iter_chunks(chunk_size):
+            yield base64.b64encode(chunk_)
+
+    def check(self) -> None:
+        """Raise :class:`EvidenceError` if the content cannot be read"""
+
+    def get_path(self) -> typing.Optional[str]:
+        """File holding exactly the content, if any, e.g. for other
+        processes to read it"""
+        return None
+
+    def digest(self) -> str:
+        """SHA-256 of the content"""
+        sha256 = hashlib.sha256()
+        for chunk_ in self.iter_chunks():
+            sha256.update(chunk_)
+        result = sha256.hexdigest()
+        return result
+
+
+class EncodedEvidence(BaseEvidence):
+    """Test evidence which has been base64-encoded already"""
+    def __init__(self, filename: str, content: str) -> None:
+        self.filename = filename
+        self.content = content
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filename={self.filename!r})"
+
+    def iter_chunks(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        yield base64.b64decode(self.content)
+
+    def iter_base64(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        yield self.content.encode("ascii")
+
+    def digest(self) -> str:
+        result = hashlib.sha256(base64.b64decode(self.content)).hexdigest()
+        return result
+
+
+class SpooledEvidence(BaseEvidence, io.BufferedIOBase):
+    """Write-once buffer for test evidence
+
+    The content is kept in memory up to ``max_size`` bytes and moved to a
+    temporary file beyond that. It is only base64-encoded, chunk by chunk,
+    when the report is written, see :meth:`iter_base64`.
+    """
+    def __init__(self, filename: str,
+                 max_size: int = DEFAULT_SPOOL_SIZE) -> None:
+        super().__init__()
+        self.filename = filename
+        self.max_size = max_size
+        self._buffer = io.BytesIO()
+        self._path = None
+        self._size = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(filename={self.filename!r}, "
+            f"size={self._size})"
+        )
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        if self.closed:
+            raise ValueError(
+                f"Evidence '{self.filename}' has already been recorded"
+            )
+        result = self._buffer.write(b)
+        self._size += result
+        if self._path is None and self._size > self.max_size:
+            self._rollover()
+        return result
+
+    def _rollover(self) -> None:
+        file_descriptor, self._path = tempfile.mkstemp(
+            prefix="junit-xray-evidence-"
+        )
+        weakref.finalize(self, _remove_file, self._path)
+        spool_file = os.fdopen(file_descriptor, "wb")
+        spool_file.write(self._buffer.getbuffer())
+        self._buffer = spool_file
+
+    def close(self) -> None:
+        if not self.closed and self._path is not None:
+            # keep the content on disk, but do not hold a file handle for
+            # every recorded evidence until the report is written
+            self._buffer.close()
+        super().close()
+
+    def get_path(self) -> typing.Optional[str]:
+        if self._path is not None and not self._buffer.closed:
+            self._buffer.flush()
+        return self._path
+
+    def iter_chunks(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        if self._path is None:
+            self._buffer.seek(0)
+            yield from iter_stream_chunks(self._buffer, chunk_size)
+        else:
+            if not self._buffer.closed:
+                self._buffer.flush()
+            with open(self._path, "rb") as spool_file:
+                yield from iter_stream_chunks(spool_file, chunk_size)
+
+
+class FileEvidence(BaseEvidence):
+    """Test evidence which already exists as a file
+
+    Only the path is stored. The file is memory-mapped and base64-encoded
+    chunk by chunk when the report is written, so it must not be removed
+    before the end of the session.
+    """
+    def __init__(self, path: typing.Union[str, os.PathLike],
+                 filename: typing.Optional[str] = None) -> None:
+        self.path = os.path.abspath(os.fspath(path))
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(
+                f"Cannot record test evidence '{self.path}': no such file"
+            )
+        self.filename = filename or os.path.basename(self.path)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(path={self.path!r}, "
+            f"filename={self.filename!r})"
+        )
+
+    def check(self) -> None:
+        if not os.path.isfile(self.path):
+            raise EvidenceError(
+                f"The test evidence file '{self.path}' has been removed"
+            )
+
+    def get_path(self) -> typing.Optional[str]:
+        return self.path
+
+    def iter_chunks(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        with open(self.path, "rb") as evidence_file:
+            size = os.fstat(evidence_file.fileno()).st_size
+            if size == 0:
+                # empty files cannot be memory-mapped
+                return
+            with mmap.mmap(evidence_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as mapped_file:
+                for offset_ in range(0, size, chunk_size):
+                    yield mapped_file[offset_:offset_ + chunk_size]
+
+
+class DeferredEvidence(BaseEvidence):
+    """Test evidence which is produced in the background
+
+    ``future`` results in the content as bytes, or as a string which is
+    encoded as UTF-8. The content is waited for, at most ``timeout``
+    seconds, by :meth:`check` right before its testcase is serialized, or
+    when its digest is needed, and then moved to a :class:`SpooledEvidence`,
+    so that it is not kept in memory beyond ``max_size`` bytes.
+    """
+    def __init__(self, filename: str, future: concurrent.futures.Future,
+                 timeout: typing.Optional[float] = None,
+                 max_size: int = DEFAULT_SPOOL_SIZE) -> None:
+        self.filename = filename
+        self.future = future
+        self.timeout = timeout
+        self.max_size = max_size
+        self._evidence = None
+        # resolved by the writer thread, or ahead by a ParallelEncoder
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(filename={self.filename!r}, "
+            f"future={self.future!r})"
+        )
+
+    def is_done(self) -> bool:
+        """Whether the content is produced, i.e. :meth:`check` returns at
+        once"""
+        future = self.future
+        return future is None or future.done()
+
+    def _resolve(self) -> SpooledEvidence:
+        with self._lock:
+            if self._evidence is None:
+                try:
+                    content = self.future.result(self.timeout)
+                except concurrent.futures.TimeoutError as exception:
+                    raise EvidenceError(
+                        f"Producing the test evidence '{self.filename}' took "
+                        f"longer than {self.timeout} s"
+                    ) from exception
+                except Exception as exception:
+                    raise EvidenceError(
+                        f"Producing the test evidence '{self.filename}' "
+                        f"failed: {exception!r}"
+                    ) from exception
+                if isinstance(content, str):
+                    content = content.encode("UTF-8")
+                evidence = SpooledEvidence(self.filename, self.max_size)
+                evidence.write(content)
+                evidence.close()
+                self._evidence = evidence
+                self.future = None
+        return self._evidence
+
+    def check(self) -> None:
+        self._resolve()
+
+    def get_path(self) -> typing.Optional[str]:
+        return self._resolve().get_path()
+
+    def iter_chunks(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        return self._resolve().iter_chunks(chunk_size)
+
+
+class CachedEvidence(BaseEvidence):
+    """Test evidence whose encoded content is shared with identical copies
+
+    ``is_copy`` tells whether identical evidence has been processed before,
+    i.e. whether the encoded content is likely to be taken from the cache.
+    """
+    def __init__(self, evidence: BaseEvidence, digest: str,
+                 cache: "EvidenceDeduplicator",
+                 is_copy: bool = False) -> None:
+        self.evidence = evidence
+        self.filename = evidence.filename
+        self.sha256 = digest
+        self.cache = cache
+        self.is_copy = is_copy
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(evidence={self.evidence!r}, "
+            f"sha256={self.sha256!r})"
+        )
+
+    def iter_chunks(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        return self.evidence.iter_chunks(chunk_size)
+
+    def iter_base64(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        return self.cache.iter_base64(self, chunk_size)
+
+    def check(self) -> None:
+        self.evidence.check()
+
+    def digest(self) -> str:
+        return self.sha256
+
+
+class EvidenceDeduplicator(object):
+    """Encodes identical test evidence only once per session
+
+    :param policy: ``cache`` writes every copy, but keeps the encoded content
+        of recent evidence in an LRU cache of at most ``cache_size`` bytes.
+        ``once`` only writes the first copy of identical evidence into the
+        report; all copies get a ``sha256`` attribute to refer to it.
+    """
+    def __init__(self, policy: str = "cache",
+                 cache_size: int = DEFAULT_CACHE_SIZE) -> None:
+        if policy not in DEDUPLICATION_POLICIES:
+            raise ValueError(
+                f"Unknown evidence deduplication policy '{policy}', expected "
+                f"one of {'|'.join(DEDUPLICATION_POLICIES)}"
+            )
+        self.policy = policy
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+        # of all evidence processed, i.e. written for the policy once
+        self._digests = set()
+
+    def process(self, evidence: BaseEvidence
+                ) -> tuple[typing.Optional[BaseEvidence], typing.Optional[str]]:
+        """Content and ``sha256`` attribute of the ``<item>`` for evidence"""
+        digest = evidence.digest()
+        is_copy = digest in self._digests
+        self._digests.add(digest)
+        if self.policy == "once":
+            result = (None, digest) if is_copy else (evidence, digest)
+        else:
+            result = (CachedEvidence(evidence, digest, self, is_copy), None)
+        return result
+
+    def iter_base64(self, evidence: CachedEvidence,
+                    chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        chunks = self._cache.get(evidence.sha256)
+        if chunks is not None:
+            self._cache.move_to_end(evidence.sha256)
+            yield from chunks
+            return
+        chunks = []
+        size = 0
+        for chunk_ in evidence.evidence.iter_base64(chunk_size):
+            yield chunk_
+            if chunks is not None:
+                size += len(chunk_)
+                if size > self.cache_size:
+                    chunks = None
+                else:
+                    chunks.append(chunk_)
+        if chunks is not None:
+            self._cache[evidence.sha256] = chunks
+            self._cached_bytes += size
+            while self._cached_bytes > self.cache_size:
+                _, evicted_chunks = self._cache.popitem(last=False)
+                self._cached_bytes -= sum(map(len, evicted_chunks))
@@ -12,3 +12,15 @@ class MoreThanOneTestKeyError(MoreThanOneItemError):
 
 class MoreThanOneTestIdError(MoreThanOneItemError):
     pass
+
+
+class EvidenceError(Exception):
+    pass
+
+
+class ReportWarning(UserWarning):
+    pass
+
+
+class EvidenceWarning(ReportWarning):
+    pass
@@ -0,0 +1,109 @@
+import concurrent.futures
+import queue
+import threading
+import typing
+
+import pytest
+
+from _pytest.config import Config
+
+
+class EvidenceExecutor(object):
+    """Thread pool which does not keep the process alive
+
+    Like ``concurrent.futures.ThreadPoolExecutor``, but its threads are
+    daemon threads, which are not joined when the interpreter exits. A
+    producer of test evidence which does not return, and whose result has
+    been given up after ``junit_xray_evidence_timeout``, therefore does not
+    keep pytest from exiting.
+    """
+    def __init__(self, max_workers: int,
+                 thread_name_prefix: str = "junit-xray-evidence") -> None:
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._queue = queue.SimpleQueue()
+        self._threads = []
+        self._is_shut_down = False
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(max_workers={self.max_workers}, "
+            f"threads={len(self._threads)})"
+        )
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, function, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as exception:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    def submit(self, function: typing.Callable, *args,
+               **kwargs) -> concurrent.futures.Future:
+        result = concurrent.futures.Future()
+        with self._lock:
+            if self._is_shut_down:
+                raise RuntimeError(
+                    "Cannot produce test evidence after the session"
+                )
+            self._queue.put((result, function, args, kwargs))
+            if len(self._threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._run,
+                    name=f"{self.thread_name_prefix}_{len(self._threads)}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        return result
+
+    def shutdown(self) -> None:
+        """Cancel the evidence which is not produced yet
+
+        Producers which are running are not waited for.
+        """
+        with self._lock:
+            self._is_shut_down = True
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+            for _ in self._threads:
+                self._queue.put(None)
+
+
+_evidence_executor_key = pytest.StashKey[EvidenceExecutor]()
+_evidence_executor_lock = threading.Lock()
+
+
+def get_evidence_executor(config: Config) -> EvidenceExecutor:
+    """Thread pool of the session which produces deferred test evidence"""
+    with _evidence_executor_lock:
+        result = config.stash.get(_evidence_executor_key, None)
+        if result is None:
+            result = EvidenceExecutor(
+                max_workers=int(config.getini("junit_xray_evidence_workers"))
+            )
+            config.stash[_evidence_executor_key] = result
+    return result
+
+
+def shutdown_evidence_executor(config: Config) -> None:
+    with _evidence_executor_lock:
+        executor = config.stash.get(_evidence_executor_key, None)
+        if executor is not None:
+            del config.stash[_evidence_executor_key]
+    if executor is not None:
+        executor.shutdown()
@@ -1,23 +1,30 @@
-import base64
-import io
+import concurrent.futures
+import os
 import typing
 
 import pytest
 
 from _pytest.fixtures import FixtureRequest
 
+from .evidence import DeferredEvidence, FileEvidence, SpooledEvidence
 from .exceptions import MoreThanOneItemError
-from .utils import find_items_from_user_properties
 
 
-def _record_single_item(user_properties, key: str, value: str):
-    items = find_items_from_user_properties(user_properties, key)
+_single_items_key = pytest.StashKey[dict[str, list]]()
+
+
+def _record_single_item(node: pytest.Item, key: str, value: str):
+    # remember the items recorded on this node, so that duplicates are found
+    # without scanning user_properties
+    single_items = node.stash.setdefault(_single_items_key, {})
+    items = single_items.get(key)
     if items:
         raise MoreThanOneItemError(
             f"Found a '{key}' already: '{items}'"
         )
     else:
-        user_properties.append(
+        single_items[key] = [value]
+        node.user_properties.append(
             (key, value)
         )
 
@@ -25,33 +32,25 @@ def _record_single_item(user_properties, key: str, value: str):
 @pytest.fixture
 def record_test_evidence(request: FixtureRequest) -> typing.Callable[[dict],
                                                                      None]:
-    class InMemoryFile(io.BytesIO):
+    spool_size = int(request.config.getini("junit_xray_evidence_spool_size"))
+
+    class InMemoryFile(SpooledEvidence):
         def __init__(self, filename: str, mode: str = "wb",
                      encoding: str = "UTF-8", *args, **kwargs):
             self.__filename = filename
             self.__mode = mode
             self.__encoding = encoding
-            super().__init__()
+            super().__init__(filename, max_size=spool_size)
 
         def __exit__(self, *args, **kwargs):
-            item = self._get_test_evidence_encoded(
-                self.__filename, self.getvalue()
-            )
             request.node.user_properties.append(
-                ("test_evidence", item)
+                ("test_evidence", self)
             )
-            super().__exit__()
-
-        def _get_test_evidence_encoded(self, name: str, content: str) -> dict:
-            result = {
-                "filename": name,
-                "content": base64.b64encode(content).decode("ascii")
-            }
-            return result
+            super().__exit__(*args, **kwargs)
 
         def write(self, b, *args, **kwargs):
             if "b" in self.__mode:
-                super().write(b)
+                return super().write(b)
             elif self.__encoding is None:
                 raise ValueError(
                     f"Calling InMemoryFile(filename='{self.__filename}', "
@@ -60,22 +59,53 @@ def record_test_evidence(request: FixtureRequest) -> typing.Callable[[dict],
                     "supply an encoding"
                 )
             else:
-                super().write(b.encode(self.__encoding), *args, **kwargs)
+                return super().write(b.encode(self.__encoding))
+
+    def _record_test_evidence(filename: str, mode="wb", *args, **kwargs):
+        if callable(mode) or isinstance(mode, concurrent.futures.Future):
+            # produced in the background while the test continues
+            from .executors import get_evidence_executor
+
+            if isinstance(mode, concurrent.futures.Future):
+                future = mode
+            else:
+                future = get_evidence_executor(request.config).submit(mode)
+            timeout = float(
+                request.config.getini("junit_xray_evidence_timeout")
+            )
+            result = DeferredEvidence(
+                filename, future, timeout or None, spool_size
+            )
+            request.node.user_properties.append(("test_evidence", result))
+        else:
+            result = InMemoryFile(filename, mode, *args, **kwargs)
+        return result
+
+    return _record_test_evidence
+
 
-    return InMemoryFile
+@pytest.fixture
+def record_test_evidence_file(request: FixtureRequest) -> typing.Callable[
+        [typing.Union[str, os.PathLike], typing.Optional[str]], None]:
+    def _record_test_evidence_file(path: typing.Union[str, os.PathLike],
+                                   name: typing.Optional[str] = None) -> None:
+        request.node.user_properties.append(
+            ("test_evidence", FileEvidence(path, name))
+        )
+    return _record_test_evidence_file
 
 
 @pytest.fixture
 def record_test_key(request: FixtureRequest) -> typing.Callable[[str], None]:
     def _record_test_key(test_key: str) -> None:
-        _record_single_item(request.node.user_properties, "test_key", test_key)
+        _record_single_item(request.node, "test_key", test_key)
     return _record_test_key
 
 
 @pytest.fixture
 def record_test_id(request: FixtureRequest) -> typing.Callable[[str], None]:
     def _record_test_id(test_id: str) -> None:
-        _record_single_item(request.node.user_properties, "test_id", test_id)
+        _record_single_item(request.node, "test_id", test_id)
     return _record_test_id
 
 
@@ -83,11 +113,7 @@ def record_test_id(request: FixtureRequest) -> typing.Callable[[str], None]:
 def record_test_summary(request: FixtureRequest) -> typing.Callable[[str],
                                                                     None]:
     def _record_test_summary(test_summary: str) -> None:
-        _record_single_item(
-            request.node.user_properties,
-            "test_summary",
-            test_summary
-        )
+        _record_single_item(request.node, "test_summary", test_summary)
     return _record_test_summary
 
 
@@ -1,278 +1,520 @@
 import os.path
 import pathlib
-import platform
+import threading
 import time
-from xml.etree.ElementTree import Element, ElementTree, indent
-from xml.sax.saxutils import escape, quoteattr
+import typing
 
+import pytest
+
+from .captures import OutputLimiter
+from .compressors import get_compression
+from .defaults import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_SPOOL_SIZE
+)
+from .encoders import ParallelEncoder, ParallelEvidence
+from .evidence import (
+    DeferredEvidence,
+    EncodedEvidence,
+    EvidenceDeduplicator
+)
 from .exceptions import (
+    EvidenceError,
     MoreThanOneTestSummaryError,
     MoreThanOneTestIdError,
     MoreThanOneTestKeyError
 )
-from .utils import find_items_from_user_properties
+from .merge import update_report
+from .metadata import get_item_metadata, load_key_map
+from .profiling import ProfiledEvidence, ReportProfiler
+from .records import ResultRecord
+from .serializers import INDENT_SPACE, get_serializer
+from .stats import ReportStats
+from .timings import PHASES, SlowestTimings
+from .utils import index_user_properties
+from .xray_json import JsonSerializer, XrayJsonWriter, get_report_format
+from .writers import (
+    ShardedWriter,
+    StreamingWriter,
+    ThreadedWriter,
+    TreeWriter,
+    get_suite_attributes
+)
 
 from _pytest.reports import TestReport
 
 
 class LogJunitXrayXml(object):
     def __init__(self, logfile: str, family: str, logging: str = "no",
-                 log_passing_tests: bool = True) -> None:
+                 log_passing_tests: bool = True,
+                 streaming: bool = False, evidence_deduplication: str = "no",
+                 evidence_cache_size: int = DEFAULT_CACHE_SIZE,
+                 max_bytes: typing.Optional[int] = None,
+                 max_tests: typing.Optional[int] = None,
+                 writer_thread: bool = False,
+                 writer_queue_size: int = DEFAULT_QUEUE_SIZE,
+                 serializer: str = "direct", compact: bool = False,
+                 compression: str = "auto",
+                 compression_level: typing.Optional[int] = None,
+                 update: bool = False, profile: bool = False,
+                 profile_file: typing.Optional[str] = None,
+                 phase_durations: bool = False, slowest: int = 0,
+                 output_limit: typing.Optional[int] = None,
+                 output_run_limit: typing.Optional[int] = None,
+                 output_spool_size: int = DEFAULT_SPOOL_SIZE,
+                 key_map: typing.Optional[str] = None,
+                 report_format: str = "auto",
+                 project_key: typing.Optional[str] = None,
+                 encoding_workers: int = 0,
+                 encoding_window: typing.Optional[int] = None) -> None:
         """
 
         :param family: determines the JUnit family
         :param logfile: name of the XML file
         :param log_passing_tests:
+        :param streaming: write each testcase to disk as soon as it is
+            finished instead of keeping the whole report in memory
+        :param evidence_deduplication: one of no|cache|once, see
+            :class:`EvidenceDeduplicator`
+        :param evidence_cache_size: maximum size in bytes of the encoded
+            evidence kept by the ``cache`` deduplication policy
+        :param max_bytes: split the report into shards of about this size
+        :param max_tests: split the report into shards of at most this number
+            of testcases
+        :param writer_thread: serialize and write the testcases in a
+            background thread, implies ``streaming``
+        :param writer_queue_size: maximum number of testcases waiting for the
+            background thread
+        :param serializer: one of direct|etree|lxml, see
+            :mod:`pytest_junit_xray_xml.serializers`
+        :param compact: write the report without indentation
+        :param compression: one of auto|none|gzip|zstd, ``auto`` selects the
+            compression by the extension of ``logfile``, e.g. ``.xml.gz``
+        :param compression_level: level of the compressor, its default if
+            ``None``
+        :param update: replace only the testcases which are run again in an
+            existing report, see :func:`update_report`
+        :param profile: measure the time spent in each phase of reporting,
+            see :class:`ReportProfiler`
+        :param profile_file: write the measurements to this JSON file
+        :param phase_durations: add the durations of setup, call and teardown
+            of each test as properties to its testcases
+        :param slowest: list this number of slowest tests and fixtures in the
+            ``<properties>`` of the ``<test_suite>``
+        :param output_limit: maximum number of characters of captured output
+            per testcase and stream, see :class:`OutputLimiter`
+        :param output_run_limit: maximum number of characters of captured
+            output of the whole session
+        :param output_spool_size: captured output above this number of
+            characters is moved to a temporary file
+        :param key_map: JSON file with Xray metadata by test id, see
+            :func:`load_key_map`
+        :param report_format: one of auto|xml|json, ``json`` writes the Xray
+            JSON import format, see :func:`get_report_format`
+        :param project_key: Jira project of the test execution and of the
+            tests without a test key in the Xray JSON format
+        :param encoding_workers: number of processes base64-encoding large
+            evidence, see :class:`ParallelEncoder`, ``0`` to encode it in
+            the writing thread
+        :param encoding_window: maximum number of encoded chunks waiting to
+            be written, twice ``encoding_workers`` if ``None``
         """
         xmlfile = os.path.expanduser(os.path.expandvars(logfile))
         self.xmlfile = os.path.normpath(os.path.abspath(xmlfile))
         self.family = family
         self.logging = logging
         self.log_passing_tests = log_passing_tests
+        self.output_limiter = OutputLimiter(
+            output_limit, output_run_limit, output_spool_size
+        )
         self.suite_start_time = None
-        self.element_tree = ElementTree(Element("test_suite"))
+        self.stats = ReportStats()
+        self.phase_durations = phase_durations
+        self.key_map = {} if key_map is None else load_key_map(key_map)
+        # Xray properties by nodeid, resolved once at collection
+        self.item_metadata = {}
+        self.slowest = SlowestTimings(slowest) if slowest else None
+        # testcases are written once the teardown of their test is reported,
+        # when the durations of all phases are known. Tests may run
+        # concurrently in threads, so the state is keyed by nodeid and
+        # changed under a lock.
+        self._pending_records = {}
+        self._pending_durations = {}
+        self._lock = threading.Lock()
+        self.profiler = ReportProfiler(enabled=profile or bool(profile_file))
+        self.profile_file = profile_file and os.path.abspath(profile_file)
+        if evidence_deduplication == "no":
+            self.evidence_deduplicator = None
+        else:
+            self.evidence_deduplicator = EvidenceDeduplicator(
+                evidence_deduplication, evidence_cache_size
+            )
+        self.encoder = ParallelEncoder(encoding_workers, encoding_window) \
+            if encoding_workers else None
+        self.report_format = get_report_format(self.xmlfile, report_format)
+        if self.report_format == "json":
+            self.serializer = JsonSerializer(
+                None if compact else INDENT_SPACE, project_key
+            )
+        else:
+            self.serializer = get_serializer(
+                serializer, None if compact else INDENT_SPACE
+            )
+        self.compression = get_compression(self.xmlfile, compression)
+        self.compression_level = compression_level
+        self.is_sharded = bool(max_bytes or max_tests)
+        if update and self.is_sharded:
+            raise pytest.UsageError("Sharded reports cannot be updated")
+        if update and family == "xunit2":
+            # the testcases have no file, so tests of the same name in
+            # different files cannot be told apart
+            raise pytest.UsageError(
+                "Reports of junit_family xunit2 cannot be updated"
+            )
+        if self.is_sharded and evidence_deduplication == "once":
+            # every shard must be standalone
+            raise pytest.UsageError(
+                "Sharded reports require junit_xray_evidence_deduplication "
+                "no or cache, since evidence written once would only be in "
+                "one of the shards"
+            )
+        if self.report_format == "json" and (update or max_bytes or max_tests):
+            raise pytest.UsageError(
+                "Reports in the Xray JSON format cannot be updated or sharded"
+            )
+        if self.report_format == "json" and evidence_deduplication == "once":
+            # the JSON format cannot refer to evidence written before
+            raise pytest.UsageError(
+                "Reports in the Xray JSON format require "
+                "junit_xray_evidence_deduplication no or cache"
+            )
+        self.update = update and os.path.isfile(self.xmlfile)
+        # when updating, the testcases of this session are written next to
+        # the existing report first
+        self.report_file = f"{self.xmlfile}.update" if self.update \
+            else self.xmlfile
+        if self.report_format == "json":
+            self.writer = XrayJsonWriter(
+                self.report_file, self.serializer, self.compression,
+                self.compression_level
+            )
+        elif max_bytes or max_tests:
+            self.writer = ShardedWriter(
+                self.xmlfile, max_bytes, max_tests, self.serializer,
+                self.compression, self.compression_level
+            )
+        elif streaming or writer_thread:
+            # the background thread only has work to do if the testcases are
+            # serialized as they are added
+            self.writer = StreamingWriter(
+                self.report_file, self.serializer, self.compression,
+                self.compression_level
+            )
+        else:
+            self.writer = TreeWriter(
+                self.report_file, self.serializer, self.compression,
+                self.compression_level
+            )
+        if writer_thread:
+            self.writer = ThreadedWriter(self.writer, writer_queue_size)
 
         if self.family == "legacy":
             self.family = "xunit1"
 
-    @property
-    def suite_node(self):
-        result = self.element_tree.getroot()
-        return result
-
-    def _get_number_of_failed_tests(self) -> int:
-        result = len(self.suite_node.findall("testcase/failure"))
-        return result
-
-    def _get_number_of_skipped_tests(self) -> int:
-        result = len(self.suite_node.findall("testcase/skipped"))
-        return result
-
-    def _get_number_of_errors(self) -> int:
-        result = len(self.suite_node.findall("testcase/error"))
-        return result
-
-    def _get_number_of_tests(self) -> int:
-        result = len(self.suite_node.findall("testcase"))
-        return result
-
     def pytest_sessionstart(self) -> None:
         self.suite_start_time = time.time()
+        self.profiler.start()
 
     def pytest_sessionfinish(self) -> None:
         suite_stop_time = time.time()
         suite_time_delta = suite_stop_time - self.suite_start_time
 
-        self.suite_node.set("name", "pytest")
-        self.suite_node.set("tests", f"{len(self.suite_node)}")
-        self.suite_node.set("time", f"{suite_time_delta:.3f}")
-        self.suite_node.set("hostname", platform.node())
-        self.suite_node.set(
-            "failures",
-            f"{self._get_number_of_failed_tests()}"
-        )
-        self.suite_node.set(
-            "skipped",
-            f"{self._get_number_of_skipped_tests()}"
-        )
-        self.suite_node.set("tests", f"{self._get_number_of_tests()}")
-        self.suite_node.set("errors", f"{self._get_number_of_errors()}")
-        indent(self.element_tree, space="    ", level=0)
-        self.element_tree.write(
-            self.xmlfile,
-            xml_declaration='<?xml version="1.0" encoding="UTF-8"?>',
-            encoding="UTF-8",
-            method="xml"
-        )
+        self._finish_pending_tests()
+        properties = None if self.slowest is None \
+            else self.slowest.to_element()
+        with self.profiler.measure("write_report"):
+            self.writer.close(
+                get_suite_attributes(self.stats, suite_time_delta),
+                properties
+            )
+        self._close_encoder()
+        if self.update:
+            with self.profiler.measure("update_report"):
+                update_report(
+                    self.xmlfile, self.report_file, self.compression,
+                    self.compression_level, self.serializer.space is None,
+                    properties
+                )
+            os.remove(self.report_file)
+        self._finish_profile(self._get_report_size())
+
+    def _close_encoder(self) -> None:
+        if self.encoder is not None:
+            self.encoder.close()
+
+    def _get_report_size(self) -> int:
+        writer = getattr(self.writer, "writer", self.writer)
+        if isinstance(writer, ShardedWriter):
+            result = sum(shard_["bytes"] for shard_ in writer.shards)
+        elif os.path.isfile(self.xmlfile):
+            result = os.path.getsize(self.xmlfile)
+        else:
+            result = 0
+        return result
 
-    def pytest_runtest_logstart(self, nodeid: str, location: list) -> None:
-        self.location = location
+    def _finish_profile(self, bytes_written: int) -> None:
+        if self.profiler.enabled:
+            self.profiler.stop()
+            self.profiler.bytes_written += bytes_written
+            if self.profile_file:
+                self.profiler.write_json(self.profile_file)
+
+    def pytest_terminal_summary(self, terminalreporter) -> None:
+        if self.profiler.enabled:
+            terminalreporter.write_sep("-", "junit-xray-xml profile")
+            for line_ in self.profiler.get_summary_lines():
+                terminalreporter.write_line(line_)
+
+    def pytest_collection_modifyitems(self, items: list[pytest.Item]) -> None:
+        for item_ in items:
+            metadata = get_item_metadata(item_, self.key_map)
+            if metadata:
+                self.item_metadata[item_.nodeid] = metadata
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        if self.slowest is None:
+            yield
+            return
+        start_time = time.perf_counter()
+        yield
+        duration = time.perf_counter() - start_time
+        with self._lock:
+            self.slowest.add_fixture(fixturedef.argname, duration)
+
+    def _finish_test(self, nodeid: str) -> None:
+        durations = self._pending_durations.pop(nodeid, {})
+        records = self._pending_records.pop(nodeid, [])
+        if self.slowest is not None:
+            self.slowest.add_test(nodeid, durations)
+        for record_ in records:
+            if self.phase_durations:
+                for phase_ in PHASES:
+                    if phase_ in durations:
+                        record_.add_property(
+                            f"{phase_}_duration", value=f"{durations[phase_]}"
+                        )
+            self.stats.add_testcase(record_.outcome)
+            with self.profiler.measure("add_testcase"):
+                self.writer.add_testcase(record_, record_.outcome)
+
+    def _finish_pending_tests(self) -> None:
+        # e.g. tests interrupted before their teardown
+        with self._lock:
+            for nodeid_ in list(self._pending_durations):
+                self._finish_test(nodeid_)
 
     def pytest_runtest_logreport(self, report: TestReport) -> None:
+        with self._lock, self.profiler.measure("logreport"):
+            self._log_report(report)
+
+    def _log_report(self, report: TestReport) -> None:
+        self.stats.add_duration(report.when, report.duration)
+        durations = self._pending_durations.setdefault(report.nodeid, {})
+        durations[report.when] = \
+            durations.get(report.when, 0.0) + report.duration
         if report.when == "call" or report.failed:
             if self.family in ("xunit1", "xray"):
-                test_result_node = Element(
-                    "testcase",
-                    classname="",
-                    name=self.location[2],
-                    file=pathlib.Path(self.location[0]).as_posix(),
-                    line=f'{self.location[1]}',
-                    duration=f'{report.duration}'
+                record = ResultRecord(
+                    name=report.location[2],
+                    file=pathlib.Path(report.location[0]).as_posix(),
+                    line=report.location[1],
+                    duration=report.duration
                 )
             elif self.family == "xunit2":
-                test_result_node = Element(
-                    "testcase",
-                    classname="",
-                    name=self.location[2],
-                    duration=f'{report.duration}'
+                record = ResultRecord(
+                    name=report.location[2],
+                    file=None,
+                    line=None,
+                    duration=report.duration
                 )
             else:
                 raise NotImplementedError(
                     f"JUnit family '{self.family}' is not implemented. "
                     "Aborting."
                 )
-            self.suite_node.append(test_result_node)
             if report.when == "call":
 
                 if report.passed:
-                    pass
+                    record.outcome = "passed"
                 elif report.failed:
-                    failure_node = Element("failure")
-                    failure_node.text = escape(report.longreprtext)
-                    test_result_node.append(failure_node)
+                    record.outcome = "failure"
+                    record.text = report.longreprtext
                 elif report.skipped:
-                    skipped_node = Element(
-                        "skipped",
-                        message=quoteattr(report.longreprtext)
+                    record.outcome = "skipped"
+                    record.message = report.longreprtext
+                profiler = self.profiler
+                with profiler.measure("process_caplog_capstdout_capstderr"):
+                    _process_caplog_capstdout_capstderr(
+                        report,
+                        record,
+                        self.logging,
+                        self.log_passing_tests,
+                        self.output_limiter
                     )
-                    test_result_node.append(skipped_node)
-                _process_caplog_capstdout_capstderr(
-                    report,
-                    test_result_node,
-                    self.logging,
-                    self.log_passing_tests
-                )
                 if self.family == "xray":
-                    properties_node = _get_properties_node(test_result_node)
-                    _process_test_evidences(
-                        report.user_properties,
-                        properties_node
-                    )
-                    _process_test_description(
-                        report.user_properties,
-                        properties_node
+                    user_properties = index_user_properties(
+                        report.user_properties
                     )
-                    _process_test_summary(
-                        report.user_properties, properties_node
-                    )
-                    _process_test_key(report.user_properties, properties_node)
-                    _process_test_id(report.user_properties, properties_node)
-
-                    if len(properties_node) == 0:
-                        test_result_node.remove(properties_node)
+                    metadata = self.item_metadata.get(report.nodeid)
+                    if metadata:
+                        # recorded at runtime takes precedence
+                        for name_, value_ in metadata.items():
+                            user_properties.setdefault(name_, [value_])
+                    with profiler.measure("process_test_evidences"):
+                        _process_test_evidences(
+                            user_properties,
+                            record,
+                            self.evidence_deduplicator,
+                            profiler,
+                            self.encoder
+                        )
+                    with profiler.measure("process_test_description"):
+                        _process_test_description(user_properties, record)
+                    with profiler.measure("process_test_summary"):
+                        _process_test_summary(user_properties, record)
+                    with profiler.measure("process_test_key"):
+                        _process_test_key(user_properties, record)
+                    with profiler.measure("process_test_id"):
+                        _process_test_id(user_properties, record)
             elif report.failed:
-                _process_error(report, test_result_node)
-
-
-def _get_properties_node(test_result_node: Element) -> Element:
-    properties_node = test_result_node.find("./properties")
-    if properties_node:
-        result = properties_node
-    else:
-        result = Element("properties")
-        test_result_node.append(result)
-    return result
-
-
-def _process_test_evidences(user_properties: list[tuple[str, object]],
-                            properties_node: Element) -> None:
-    test_evidences = find_items_from_user_properties(
-        user_properties,
-        "test_evidence"
-    )
+                record.outcome = "error"
+                with self.profiler.measure("process_error"):
+                    _process_error(report, record)
+            self._pending_records.setdefault(report.nodeid, []).append(record)
+        if report.when == "teardown":
+            self._finish_test(report.nodeid)
+
+
+def _process_test_evidences(user_properties: dict[str, list],
+                            record: ResultRecord,
+                            deduplicator: EvidenceDeduplicator = None,
+                            profiler: ReportProfiler = None,
+                            encoder: ParallelEncoder = None) -> None:
+    test_evidences = user_properties.get("test_evidence")
     if test_evidences:
-        test_evidence_node = Element(
-            "property", name="testrun_evidence"
-        )
+        items = []
         for test_evidence_ in test_evidences:
-            item_node = Element("item", name=test_evidence_["filename"])
-            item_node.text = test_evidence_["content"]
-            test_evidence_node.append(item_node)
-        properties_node.append(test_evidence_node)
-
-
-def _process_test_description(user_properties: list[tuple[str, object]],
-                              properties_node: Element) -> None:
-    test_descriptions = find_items_from_user_properties(
-        user_properties,
-        "test_description"
-    )
+            parallel_evidence = None
+            # deferred evidence is produced while the tests go on and only
+            # waited for when its testcase is serialized, unless its digest
+            # is needed now
+            check = deduplicator is not None or \
+                not isinstance(test_evidence_, DeferredEvidence)
+            if isinstance(test_evidence_, dict):
+                test_evidence_ = EncodedEvidence(
+                    test_evidence_["filename"], test_evidence_["content"]
+                )
+            elif encoder is not None:
+                test_evidence_ = parallel_evidence = \
+                    ParallelEvidence(test_evidence_, encoder)
+            try:
+                if check:
+                    test_evidence_.check()
+            except EvidenceError as exception:
+                items.append((test_evidence_.filename, None, None))
+                record.add_evidence_error(test_evidence_.filename, exception)
+                continue
+            if profiler is not None and profiler.enabled:
+                test_evidence_ = ProfiledEvidence(test_evidence_, profiler)
+            if deduplicator is None:
+                # encoded chunk by chunk when the report is written
+                item = (test_evidence_.filename, test_evidence_, None)
+            else:
+                item = (
+                    test_evidence_.filename,
+                    *deduplicator.process(test_evidence_)
+                )
+            # encoded ahead by the processes while earlier testcases are
+            # written, unless it is not written or taken from the cache
+            if parallel_evidence is not None and item[1] is not None \
+                    and not getattr(item[1], "is_copy", False):
+                parallel_evidence.queue()
+            items.append(item)
+        record.add_property("testrun_evidence", items=items)
+
+
+def _process_test_description(user_properties: dict[str, list],
+                              record: ResultRecord) -> None:
+    test_descriptions = user_properties.get("test_description")
     if test_descriptions:
         test_description = "\n".join(test_descriptions)
-        property_node = Element("property", name="test_description")
-        property_node.text = escape(test_description)
-        properties_node.append(property_node)
+        record.add_property("test_description", text=test_description)
 
 
-def _process_test_summary(user_properties: list[tuple[str, object]],
-                          properties_node: Element) -> None:
-    test_summary = find_items_from_user_properties(
-        user_properties,
-        "test_summary"
-    )
+def _process_test_summary(user_properties: dict[str, list],
+                          record: ResultRecord) -> None:
+    test_summary = user_properties.get("test_summary")
     if test_summary:
         if len(test_summary) > 1:
             raise MoreThanOneTestSummaryError(
                 f"Found {len(test_summary)} test summaries: '{test_summary}'",
             )
-        property_node = Element(
-            "property",
-            name="test_summary",
-            value=test_summary[0]
-        )
-        properties_node.append(property_node)
+        record.add_property("test_summary", value=test_summary[0])
 
 
-def _process_test_id(user_properties: list[tuple[str, object]],
-                     properties_node: Element) -> None:
-    test_id = find_items_from_user_properties(user_properties, "test_id")
+def _process_test_id(user_properties: dict[str, list],
+                     record: ResultRecord) -> None:
+    test_id = user_properties.get("test_id")
     if test_id:
         if len(test_id) > 1:
             raise MoreThanOneTestIdError(
                 f"Found {len(test_id)} test ids: 'test_id'"
             )
-        property_node = Element("property", name="test_id", value=test_id[0])
-        properties_node.append(property_node)
+        record.add_property("test_id", value=test_id[0])
 
 
-def _process_test_key(user_properties: list[tuple[str, object]],
-                      properties_node: Element) -> None:
-    test_keys = find_items_from_user_properties(user_properties, "test_key")
+def _process_test_key(user_properties: dict[str, list],
+                      record: ResultRecord) -> None:
+    test_keys = user_properties.get("test_key")
     if test_keys:
         if len(test_keys) > 1:
             raise MoreThanOneTestKeyError(
                 f"Found {len(test_keys)} test keys: 'test_keys'",
             )
-        property_node = Element(
-            "property",
-            name="test_key",
-            value=test_keys[0]
-        )
-        properties_node.append(property_node)
+        record.add_property("test_key", value=test_keys[0])
 
 
-def _process_error(report: TestReport, test_result_node: Element) -> None:
+def _process_error(report: TestReport, record: ResultRecord) -> None:
     reprcrash = getattr(report.longrepr, "reprcrash", None)
-    message = quoteattr(
-        f"error during {report.when}: {reprcrash or str(report.longrepr)}"
+    record.message = (
+        f"error during {report.when}: {reprcrash or report.longrepr}"
     )
-    error_node = Element("error", message=message)
-    test_result_node.append(error_node)
 
 
 def _process_caplog_capstdout_capstderr(report: TestReport,
-                                        test_result_node: Element,
+                                        record: ResultRecord,
                                         logging: str,
-                                        log_passing_tests: str) -> None:
-    def _prepare_content(self, content: str, header: str) -> str:
-        return escape("\n".join([header.center(80, "-"), content, ""]))
+                                        log_passing_tests: str,
+                                        output_limiter: OutputLimiter = None
+                                        ) -> None:
+    """Captured output as configured by ``junit_logging``
 
+    :param logging: one of no|log|system-out|system-err|out-err|all
+    """
     if report.passed and not log_passing_tests:
-        pass
-    else:
-        stdout = ""
-        if report.caplog and logging in ["all", "log"]:
-            stdout += _prepare_content(report.longreprtext, " Captured Log ")
-        if report.capstdout and logging in ["all", "log"]:
-            stdout += _prepare_content(report.longreprtext, " Captured Out ")
-        if stdout:
-            stdout_node = Element("system-out")
-            stdout_node.text = stdout
-            test_result_node.append(stdout_node)
-        if report.capstderr and logging in ["system-err", "out-err", "all"]:
-            stderr_node = Element("system-err")
-            stderr_node.text = _prepare_content(
-                report.longreprtext,
-                " Captured Err "
-            )
-            test_result_node.append(stderr_node)
+        return
+    if output_limiter is None:
+        output_limiter = OutputLimiter()
+    stdout_sections = []
+    if report.caplog and logging in ("log", "all"):
+        stdout_sections.append((" Captured Log ", report.caplog))
+    if report.capstdout and logging in ("system-out", "out-err", "all"):
+        stdout_sections.append((" Captured Out ", report.capstdout))
+    if stdout_sections:
+        record.system_out = output_limiter.make_text(stdout_sections)
+    if report.capstderr and logging in ("system-err", "out-err", "all"):
+        record.system_err = output_limiter.make_text(
+            [(" Captured Err ", report.capstderr)]
+        )
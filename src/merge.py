@@ -0,0 +1,235 @@
+"""Merge several reports into a single ``<test_suite>``
+
+The reports are parsed incrementally and every testcase is written to the
+merged report as soon as it has been read, so memory usage is bounded by the
+largest testcase, not by the size of the reports. Evidence is copied as
+base64 without being decoded.
+
+Example::
+
+    junit-xray-xml-merge job-*.xml.gz --output report.xml.gz
+"""
+import argparse
+import json
+import os
+import typing
+from xml.etree.ElementTree import Element, iterparse
+
+from .compressors import COMPRESSIONS, get_compression, open_input
+from .serializers import INDENT_SPACE, DirectSerializer
+from .stats import ReportStats
+from .writers import StreamingWriter, get_suite_attributes
+
+
+SUITE_TAGS = ("test_suite", "testsuite")
+
+
+def get_outcome(testcase: Element) -> str:
+    """One of passed|failure|skipped|error, as counted by ReportStats"""
+    result = "passed"
+    for child_ in testcase:
+        if child_.tag in ("failure", "skipped", "error"):
+            result = child_.tag
+            break
+    return result
+
+
+def expand_input_paths(paths: typing.Iterable[str]) -> list[str]:
+    """Replace the index of a sharded report by its shards"""
+    result = []
+    for path_ in paths:
+        if path_.endswith(".index.json"):
+            with open(path_, encoding="UTF-8") as index_file:
+                index = json.load(index_file)
+            directory = os.path.dirname(path_)
+            result.extend(
+                os.path.join(directory, shard_["file"])
+                for shard_ in index["shards"]
+            )
+        else:
+            result.append(path_)
+    return result
+
+
+def get_identity(testcase: Element) -> tuple:
+    """Identifies a test across runs
+
+    Only unique if the testcases have a ``file``, i.e. not for the
+    ``xunit2`` family.
+    """
+    result = (
+        testcase.get("file"), testcase.get("classname"), testcase.get("name")
+    )
+    return result
+
+
+def _strip_indentation(element: Element) -> None:
+    # only nodes with child nodes are indented, their text is whitespace
+    if len(element) and element.text and not element.text.strip():
+        element.text = None
+    for child_ in element:
+        child_.tail = None
+        _strip_indentation(child_)
+
+
+class ReportMerger(object):
+    """Writes the testcases of several reports into one report
+
+    The counts of the merged suite are computed from the testcases, its time
+    is the sum of the times of the input suites.
+    """
+    def __init__(self, output_path: str, compression: str = "auto",
+                 compression_level: typing.Optional[int] = None,
+                 compact: bool = False) -> None:
+        self.output_path = os.path.abspath(output_path)
+        self.writer = StreamingWriter(
+            self.output_path,
+            DirectSerializer(None if compact else INDENT_SPACE),
+            get_compression(self.output_path, compression),
+            compression_level
+        )
+        self.stats = ReportStats()
+        self.suite_time = 0.0
+
+    def iter_testcases(self, path: str) -> typing.Iterator[Element]:
+        """Yield the testcases of a report one by one
+
+        The testcases are removed from the tree once they have been yielded.
+        The times of the suites are added to :attr:`suite_time`.
+        """
+        with open_input(path) as input_file:
+            parents = []
+            for event_, element_ in iterparse(input_file, ("start", "end")):
+                if event_ == "start":
+                    if element_.tag in SUITE_TAGS:
+                        self.suite_time += float(element_.get("time", 0.0))
+                    parents.append(element_)
+                    continue
+                parents.pop()
+                if element_.tag == "testcase":
+                    _strip_indentation(element_)
+                    yield element_
+                    if parents:
+                        parents[-1].remove(element_)
+
+    def add_testcase(self, testcase: Element) -> None:
+        outcome = get_outcome(testcase)
+        self.writer.add_testcase(testcase, outcome)
+        self.stats.add_testcase(outcome)
+
+    def add_report(self, path: str) -> None:
+        """Copy the testcases of a report one by one
+
+        Every testcase is discarded as soon as it has been written.
+        """
+        for testcase_ in self.iter_testcases(path):
+            self.add_testcase(testcase_)
+
+    def close(self, properties: typing.Optional[Element] = None) -> None:
+        """
+        :param properties: ``<properties>`` of the merged ``<test_suite>``
+        """
+        self.writer.close(
+            get_suite_attributes(self.stats, self.suite_time), properties
+        )
+
+
+def merge_reports(input_paths: typing.Iterable[str], output_path: str,
+                  compression: str = "auto",
+                  compression_level: typing.Optional[int] = None,
+                  compact: bool = False) -> ReportStats:
+    """Merge the testcases of all input reports into ``output_path``"""
+    merger = ReportMerger(
+        output_path, compression, compression_level, compact
+    )
+    for input_path_ in expand_input_paths(input_paths):
+        merger.add_report(input_path_)
+    merger.close()
+    result = merger.stats
+    return result
+
+
+def update_report(xmlfile: str, update_path: str,
+                  compression: str = "auto",
+                  compression_level: typing.Optional[int] = None,
+                  compact: bool = False,
+                  properties: typing.Optional[Element] = None
+                  ) -> ReportStats:
+    """Replace the testcases in ``xmlfile`` which were run again
+
+    A test can produce several testcases with the same identity, see
+    :func:`get_identity`, e.g. a failure in call and an error in teardown.
+    All testcases of ``update_path`` with one identity take the place of the
+    first testcase of ``xmlfile`` with that identity, the other testcases of
+    ``xmlfile`` with that identity are dropped; new testcases are appended.
+    Only the testcases of ``update_path`` are kept in memory, ``xmlfile`` is
+    streamed. The ``<properties>`` of the updated ``<test_suite>`` are
+    ``properties``, those of the session which ran the tests again.
+    """
+    merger = ReportMerger(xmlfile, compression, compression_level, compact)
+    updated_testcases: dict[tuple, list[Element]] = {}
+    for testcase_ in merger.iter_testcases(update_path):
+        updated_testcases.setdefault(get_identity(testcase_), []).append(
+            testcase_
+        )
+    replaced = set()
+    for testcase_ in merger.iter_testcases(xmlfile):
+        identity = get_identity(testcase_)
+        if identity in replaced:
+            continue
+        if identity in updated_testcases:
+            replaced.add(identity)
+            for updated_testcase_ in updated_testcases.pop(identity):
+                merger.add_testcase(updated_testcase_)
+        else:
+            merger.add_testcase(testcase_)
+    for testcases_ in updated_testcases.values():
+        for testcase_ in testcases_:
+            merger.add_testcase(testcase_)
+    if properties is not None:
+        # may have been indented when the update was written
+        _strip_indentation(properties)
+    merger.close(properties)
+    result = merger.stats
+    return result
+
+
+def main(argv: typing.Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="junit-xray-xml-merge",
+        description=__doc__.splitlines()[0]
+    )
+    parser.add_argument(
+        "reports",
+        nargs="+",
+        help="reports to merge, optionally compressed, or the index.json of "
+             "sharded reports"
+    )
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument(
+        "--compression", choices=COMPRESSIONS, default="auto",
+        help="compression of the merged report, by default selected by its "
+             "extension"
+    )
+    parser.add_argument("--compression-level", type=int, default=None)
+    parser.add_argument(
+        "--compact", action="store_true",
+        help="write the merged report without indentation"
+    )
+    arguments = parser.parse_args(argv)
+    stats = merge_reports(
+        arguments.reports,
+        arguments.output,
+        arguments.compression,
+        arguments.compression_level,
+        arguments.compact
+    )
+    print(
+        f"Merged {stats.tests} tests ({stats.failures} failures, "
+        f"{stats.skipped} skipped, {stats.errors} errors) into "
+        f"{arguments.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import json
+import os
+import typing
+
+import pytest
+
+
+MARKER_NAME = "xray"
+MARKER_DESCRIPTION = (
+    "xray(key=None, id=None, summary=None, description=None): Xray "
+    "metadata of the test, as recorded by the record_test_* fixtures"
+)
+# arguments of the marker and keys of the key map -> names of the properties
+METADATA_NAMES = {
+    "key": "test_key",
+    "id": "test_id",
+    "summary": "test_summary",
+    "description": "test_description",
+}
+
+
+def _get_properties(metadata: dict[str, str], source: str) -> dict[str, str]:
+    unknown_names = set(metadata) - set(METADATA_NAMES)
+    if unknown_names:
+        raise pytest.UsageError(
+            f"Unknown Xray metadata {sorted(unknown_names)} in {source}, "
+            f"expected some of {'|'.join(METADATA_NAMES)}"
+        )
+    result = {
+        METADATA_NAMES[name_]: value_
+        for name_, value_ in metadata.items()
+        if value_ is not None
+    }
+    return result
+
+
+def load_key_map(path: typing.Union[str, os.PathLike]
+                 ) -> dict[str, dict[str, str]]:
+    """Read Xray metadata by test id from a JSON file
+
+    The file maps test ids, e.g. ``tests/test_a.py::test_b[1]``, either to a
+    test key or to a dict with any of ``key``, ``id``, ``summary`` and
+    ``description``. Ids without parameters apply to all parametrizations.
+    """
+    with open(path, encoding="UTF-8") as key_map_file:
+        key_map = json.load(key_map_file)
+    result = {}
+    for nodeid_, metadata_ in key_map.items():
+        if isinstance(metadata_, str):
+            metadata_ = {"key": metadata_}
+        result[nodeid_] = _get_properties(metadata_, f"'{path}'")
+    return result
+
+
+def get_item_metadata(item: pytest.Item,
+                      key_map: dict[str, dict[str, str]]) -> dict[str, str]:
+    """Xray properties of ``item`` from its marker and the key map
+
+    The marker takes precedence over the key map.
+    """
+    result = {}
+    base_nodeid, _, _ = item.nodeid.partition("[")
+    result.update(key_map.get(base_nodeid, {}))
+    result.update(key_map.get(item.nodeid, {}))
+    marker = item.get_closest_marker(MARKER_NAME)
+    if marker is not None:
+        if len(marker.args) > 1:
+            raise pytest.UsageError(
+                f"The {MARKER_NAME} marker of {item.nodeid} takes at most one "
+                "positional argument, the test key"
+            )
+        metadata = dict(zip(("key",), marker.args))
+        metadata.update(marker.kwargs)
+        result.update(_get_properties(metadata, f"the marker of {item.nodeid}"))
+    return result
@@ -1,9 +1,19 @@
+import importlib
+import sys
+
 import pytest
 
-from . import junit_xml_xray_xml
+from .defaults import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_EVIDENCE_WORKERS,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_SPOOL_SIZE
+)
+from .metadata import MARKER_DESCRIPTION
 
 from _pytest.config import Config
 from _pytest.config.argparsing import Parser
+from _pytest.reports import TestReport
 
 
 def pytest_addoption(parser: Parser) -> None:
@@ -21,6 +31,47 @@ def pytest_addoption(parser: Parser) -> None:
             "by the Jira plugin Xray"
         )
     )
+    group.addoption(
+        "--junit-xray-xml-max-bytes",
+        action="store",
+        dest="junit_xray_xml_max_bytes",
+        metavar="bytes",
+        type=int,
+        default=None,
+        help=(
+            "split the report into shards report.001.xml, report.002.xml, ... "
+            "of about this size, listed in report.index.json"
+        )
+    )
+    group.addoption(
+        "--junit-xray-xml-max-tests",
+        action="store",
+        dest="junit_xray_xml_max_tests",
+        metavar="number",
+        type=int,
+        default=None,
+        help=(
+            "split the report into shards report.001.xml, report.002.xml, ... "
+            "of at most this number of tests, listed in report.index.json"
+        )
+    )
+    group.addoption(
+        "--junit-xray-xml-update",
+        action="store_true",
+        dest="junit_xray_xml_update",
+        default=False,
+        help=(
+            "replace only the testcases which are run again in an existing "
+            "report, e.g. together with --lf"
+        )
+    )
+    group.addoption(
+        "--junit-xray-xml-compact",
+        action="store_true",
+        dest="junit_xray_xml_compact",
+        default=False,
+        help="write the report without indentation, see junit_xray_compact"
+    )
     parser.addini(
         "junit_suite_name",
         "Test suite name for JUnit report",
@@ -44,18 +95,280 @@ def pytest_addoption(parser: Parser) -> None:
         "Emit XML for schema: one of legacy|xunit1|xunit2|xray",
         default="xray",
     )
+    parser.addini(
+        "junit_xray_streaming",
+        "Write each testcase to the report as soon as it is finished instead "
+        "of keeping the whole report in memory until the end of the session.",
+        type="bool",
+        default=False
+    )
+    parser.addini(
+        "junit_xray_evidence_spool_size",
+        "Size in bytes above which recorded test evidence is moved from "
+        "memory to a temporary file.",
+        default=f"{DEFAULT_SPOOL_SIZE}"
+    )
+    parser.addini(
+        "junit_xray_evidence_workers",
+        "Number of threads producing the test evidence which is recorded as "
+        "a callable.",
+        default=f"{DEFAULT_EVIDENCE_WORKERS}"
+    )
+    parser.addini(
+        "junit_xray_evidence_timeout",
+        "Seconds to wait for test evidence which is produced in the "
+        "background, 0 to wait without limit.",
+        default="0"
+    )
+    parser.addini(
+        "junit_xray_evidence_deduplication",
+        "Handling of identical test evidence: one of no|cache|once. 'cache' "
+        "encodes identical evidence only once, 'once' additionally writes it "
+        "only once into the report.",
+        default="no"
+    )
+    parser.addini(
+        "junit_xray_evidence_cache_size",
+        "Maximum size in bytes of the encoded evidence kept in memory for "
+        "junit_xray_evidence_deduplication = cache",
+        default=f"{DEFAULT_CACHE_SIZE}"
+    )
+    parser.addini(
+        "junit_xray_serializer",
+        "Serializer for the testcases: one of direct|etree|lxml. 'lxml' "
+        "requires lxml to be installed.",
+        default="direct"
+    )
+    parser.addini(
+        "junit_xray_compact",
+        "Write the report without indentation and line breaks.",
+        type="bool",
+        default=False
+    )
+    parser.addini(
+        "junit_xray_compression",
+        "Compression of the report: one of auto|none|gzip|zstd. 'auto' "
+        "selects it by the extension of the report, .gz or .zst. 'zstd' "
+        "requires zstandard to be installed.",
+        default="auto"
+    )
+    parser.addini(
+        "junit_xray_compression_level",
+        "Compression level, the default of the compressor if empty.",
+        default=""
+    )
+    parser.addini(
+        "junit_xray_format",
+        "Format of the report: one of auto|xml|json. 'json' writes the Xray "
+        "JSON import format, 'auto' selects it for reports named *.json.",
+        default="auto"
+    )
+    parser.addini(
+        "junit_xray_project_key",
+        "Key of the Jira project of the test execution in the Xray JSON "
+        "format. Tests without a test key are created in this project.",
+        default=""
+    )
+    parser.addini(
+        "junit_xray_key_map",
+        "JSON file mapping test ids to Xray test keys or to dicts of key, id, "
+        "summary and description, relative to the rootdir.",
+        default=""
+    )
+    parser.addini(
+        "junit_xray_output_limit",
+        "Maximum number of characters of captured output per testcase and "
+        "stream; the middle of longer output is cut out. 0 for no limit.",
+        default="0"
+    )
+    parser.addini(
+        "junit_xray_output_run_limit",
+        "Maximum number of characters of captured output of the whole "
+        "session. 0 for no limit.",
+        default="0"
+    )
+    parser.addini(
+        "junit_xray_output_spool_size",
+        "Number of characters above which captured output is moved from "
+        "memory to a temporary file.",
+        default=f"{DEFAULT_SPOOL_SIZE}"
+    )
+    parser.addini(
+        "junit_xray_phase_durations",
+        "Add the durations of setup, call and teardown of each test as "
+        "properties to its testcase.",
+        type="bool",
+        default=False
+    )
+    parser.addini(
+        "junit_xray_slowest",
+        "List this number of slowest tests and fixtures in the properties of "
+        "the test suite, 0 to disable.",
+        default="0"
+    )
+    parser.addini(
+        "junit_xray_profile",
+        "Measure the time spent in each phase of writing the report and show "
+        "it in the terminal summary.",
+        type="bool",
+        default=False
+    )
+    parser.addini(
+        "junit_xray_profile_file",
+        "Write the measurements of junit_xray_profile to this JSON file.",
+        default=""
+    )
+    parser.addini(
+        "junit_xray_writer_thread",
+        "Serialize and write the testcases in a background thread; implies "
+        "junit_xray_streaming.",
+        type="bool",
+        default=False
+    )
+    parser.addini(
+        "junit_xray_writer_queue_size",
+        "Maximum number of testcases waiting for the background thread.",
+        default=f"{DEFAULT_QUEUE_SIZE}"
+    )
+    parser.addini(
+        "junit_xray_encoding_workers",
+        "Number of processes base64-encoding the test evidence ahead of "
+        "writing it, 0 to encode it in the writing thread.",
+        default="0"
+    )
+    parser.addini(
+        "junit_xray_encoding_window",
+        "Maximum number of encoded chunks of evidence waiting to be "
+        "written, 0 for twice the number of processes.",
+        default="0"
+    )
+
+
+def _is_xdist_controller(config: Config) -> bool:
+    # same check as pytest-xdist, whose pytest_configure may run after ours
+    result = (
+        config.getoption("dist", "no") != "no"
+        and bool(config.getoption("tx", None))
+        and not config.getoption("collectonly")
+    )
+    return result
+
+
+class WorkerEvidenceNames(object):
+    """Replaces recorded test evidence by its name on pytest-xdist workers
+
+    The reports are sent to the controller through execnet, which cannot
+    serialize the evidence objects. Registered on every worker, with or
+    without a report; the report plugin of the worker is registered later,
+    so its ``tryfirst`` hook sees the evidence before it is replaced.
+    """
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        report.user_properties = [
+            (name_, {"filename": value_.filename})
+            if name_ == "test_evidence" and not isinstance(value_, dict)
+            else (name_, value_)
+            for name_, value_ in report.user_properties
+        ]
+
+
+def _get_plugin_kwargs(config: Config, logfile: str) -> dict:
+    """Arguments of the report plugin from the options and ini values
+
+    Raises ``ValueError`` for malformed numbers.
+    """
+    result = dict(
+        logfile=logfile,
+        family=config.getini("junit_family"),
+        logging=config.getini("junit_logging"),
+        log_passing_tests=config.getini("junit_log_passing_tests"),
+        streaming=config.getini("junit_xray_streaming"),
+        evidence_deduplication=config.getini(
+            "junit_xray_evidence_deduplication"
+        ),
+        evidence_cache_size=int(
+            config.getini("junit_xray_evidence_cache_size")
+        ),
+        max_bytes=config.option.junit_xray_xml_max_bytes,
+        max_tests=config.option.junit_xray_xml_max_tests,
+        writer_thread=config.getini("junit_xray_writer_thread"),
+        writer_queue_size=int(
+            config.getini("junit_xray_writer_queue_size")
+        ),
+        serializer=config.getini("junit_xray_serializer"),
+        compact=(
+            config.option.junit_xray_xml_compact
+            or config.getini("junit_xray_compact")
+        ),
+        update=config.option.junit_xray_xml_update,
+        output_limit=int(config.getini("junit_xray_output_limit")) or None,
+        output_run_limit=(
+            int(config.getini("junit_xray_output_run_limit")) or None
+        ),
+        output_spool_size=int(
+            config.getini("junit_xray_output_spool_size")
+        ),
+        key_map=(
+            str(config.rootpath / config.getini("junit_xray_key_map"))
+            if config.getini("junit_xray_key_map") else None
+        ),
+        report_format=config.getini("junit_xray_format"),
+        project_key=config.getini("junit_xray_project_key") or None,
+        encoding_workers=int(config.getini("junit_xray_encoding_workers")),
+        encoding_window=(
+            int(config.getini("junit_xray_encoding_window")) or None
+        ),
+        phase_durations=config.getini("junit_xray_phase_durations"),
+        slowest=int(config.getini("junit_xray_slowest")),
+        profile=config.getini("junit_xray_profile"),
+        profile_file=config.getini("junit_xray_profile_file") or None,
+        compression=config.getini("junit_xray_compression"),
+        compression_level=(
+            int(config.getini("junit_xray_compression_level"))
+            if config.getini("junit_xray_compression_level") else None
+        )
+    )
+    return result
 
 
 @pytest.hookimpl(trylast=True)
 def pytest_configure(config: Config) -> None:
+    config.addinivalue_line("markers", MARKER_DESCRIPTION)
+    if hasattr(config, "workerinput"):
+        config.pluginmanager.register(
+            WorkerEvidenceNames(), "junit_xray_worker_evidence_names"
+        )
     logfile = config.option.junit_xray_xml_path
-    # prevent opening xml on work nodes (xdist)
-    if logfile and not hasattr(config, "workerinput"):
-        config._junitxray = junit_xml_xray_xml.LogJunitXrayXml(
-            logfile=logfile,
-            family=config.getini("junit_family"),
-            log_passing_tests=config.getini("junit_log_passing_tests")
+    if logfile:
+        # only load the report machinery if a report is requested; looked up
+        # in sys.modules, so that it is loaded again if it has been removed
+        # from there, e.g. by pytester
+        distributed = importlib.import_module(".distributed", __package__)
+        junit_xml_xray_xml = importlib.import_module(
+            ".junit_xml_xray_xml", __package__
         )
+
+        try:
+            kwargs = _get_plugin_kwargs(config, logfile)
+            if hasattr(config, "workerinput"):
+                # pytest-xdist worker
+                config._junitxray = distributed.LogJunitXrayXmlWorker(
+                    workeroutput=config.workeroutput,
+                    worker_id=config.workerinput["workerid"],
+                    **kwargs
+                )
+            elif _is_xdist_controller(config):
+                # pytest-xdist controller
+                config._junitxray = distributed.LogJunitXrayXmlController(
+                    **kwargs
+                )
+            else:
+                config._junitxray = junit_xml_xray_xml.LogJunitXrayXml(
+                    **kwargs
+                )
+        except ValueError as exception:
+            # unknown or malformed values of the ini options
+            raise pytest.UsageError(str(exception)) from exception
         config.pluginmanager.register(config._junitxray)
 
 
@@ -64,3 +377,7 @@ def pytest_unconfigure(config: Config) -> None:
     if junitxray is not None:
         del config._junitxray
         config.pluginmanager.unregister(junitxray)
+    if "pytest_junit_xray_xml.executors" in sys.modules:
+        # the thread pool only exists if evidence was produced in it
+        sys.modules["pytest_junit_xray_xml.executors"].\
+            shutdown_evidence_executor(config)
@@ -0,0 +1,140 @@
+import contextlib
+import json
+import time
+import tracemalloc
+import typing
+
+from .evidence import EVIDENCE_CHUNK_SIZE, BaseEvidence
+
+
+class ReportProfiler(object):
+    """Accumulates the time the plugin spends in each phase of reporting
+
+    Nothing is measured unless ``enabled`` is set, so the profiler can always
+    be called. The peak memory is traced with ``tracemalloc`` for the whole
+    session, i.e. it includes the memory used by the tests themselves.
+    """
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.timings = {}
+        self.calls = {}
+        self.bytes_written = 0
+        self.peak_memory = None
+        self._started_tracemalloc = False
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(enabled={self.enabled}, "
+            f"timings={self.timings!r})"
+        )
+
+    def add_timing(self, name: str, duration: float, calls: int = 1) -> None:
+        self.timings[name] = self.timings.get(name, 0.0) + duration
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    @contextlib.contextmanager
+    def _measure(self, name: str) -> typing.Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start_time)
+
+    def measure(self, name: str) -> typing.ContextManager[None]:
+        """Add the time spent in the ``with`` block to ``name``"""
+        if self.enabled:
+            result = self._measure(name)
+        else:
+            result = contextlib.nullcontext()
+        return result
+
+    def start(self) -> None:
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self) -> None:
+        if self.enabled and tracemalloc.is_tracing():
+            _, peak_memory = tracemalloc.get_traced_memory()
+            self.peak_memory = max(self.peak_memory or 0, peak_memory)
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    def to_dict(self) -> dict:
+        result = {
+            "timings": {
+                name_: {"seconds": seconds_, "calls": self.calls[name_]}
+                for name_, seconds_ in self.timings.items()
+            },
+            "bytes_written": self.bytes_written,
+            "peak_memory": self.peak_memory,
+        }
+        return result
+
+    def update(self, other: dict) -> None:
+        """Add the measurements of ``other``, as returned by :meth:`to_dict`
+
+        The peak memory is the maximum of both, since the processes of
+        pytest-xdist run at the same time.
+        """
+        for name_, timing_ in other["timings"].items():
+            self.add_timing(name_, timing_["seconds"], timing_["calls"])
+        self.bytes_written += other["bytes_written"]
+        if other["peak_memory"] is not None:
+            self.peak_memory = max(
+                self.peak_memory or 0, other["peak_memory"]
+            )
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w", encoding="UTF-8") as json_file:
+            json.dump(self.to_dict(), json_file, indent=4)
+
+    def get_summary_lines(self) -> list[str]:
+        result = [
+            f"{name_:<36} {seconds_:10.3f}s {self.calls[name_]:10d} calls"
+            for name_, seconds_ in sorted(
+                self.timings.items(), key=lambda item_: -item_[1]
+            )
+        ]
+        result.append(f"{'bytes written':<36} {self.bytes_written:11d}")
+        if self.peak_memory is not None:
+            result.append(
+                f"{'peak traced memory':<36} {self.peak_memory:11d}"
+            )
+        return result
+
+
+class ProfiledEvidence(BaseEvidence):
+    """Test evidence whose base64 encoding is timed by a profiler"""
+    def __init__(self, evidence: BaseEvidence,
+                 profiler: ReportProfiler) -> None:
+        self.evidence = evidence
+        self.filename = evidence.filename
+        self.profiler = profiler
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(evidence={self.evidence!r})"
+
+    def iter_chunks(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        return self.evidence.iter_chunks(chunk_size)
+
+    def iter_base64(self, chunk_size: int = EVIDENCE_CHUNK_SIZE
+                    ) -> typing.Iterator[bytes]:
+        chunks = self.evidence.iter_base64(chunk_size)
+        duration = 0.0
+        while True:
+            start_time = time.perf_counter()
+            chunk = next(chunks, None)
+            duration += time.perf_counter() - start_time
+            if chunk is None:
+                break
+            yield chunk
+        self.profiler.add_timing("encode_evidence", duration)
+
+    def check(self) -> None:
+        self.evidence.check()
+
+    def digest(self) -> str:
+        return self.evidence.digest()
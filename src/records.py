@@ -0,0 +1,130 @@
+import sys
+import typing
+import warnings
+from xml.etree.ElementTree import Element
+
+from .exceptions import EvidenceError, EvidenceWarning
+
+
+class ResultRecord(object):
+    """Compact result of a single testcase
+
+    Only the values needed for the ``<testcase>`` node are kept; the node is
+    produced when the report is written. ``properties`` holds
+    ``(name, value, text, items)`` tuples, where ``items`` is a list of
+    ``(name, evidence, sha256)`` tuples for the ``testrun_evidence`` property
+    and ``None`` otherwise.
+    """
+    __slots__ = (
+        "name",
+        "file",
+        "line",
+        "duration",
+        "outcome",
+        "message",
+        "text",
+        "system_out",
+        "system_err",
+        "properties",
+    )
+
+    def __init__(self, name: str, file: typing.Optional[str],
+                 line: typing.Optional[int], duration: float,
+                 outcome: str = "passed") -> None:
+        self.name = name
+        self.file = None if file is None else sys.intern(file)
+        self.line = line
+        self.duration = duration
+        self.outcome = outcome
+        self.message = None
+        self.text = None
+        self.system_out = None
+        self.system_err = None
+        self.properties = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(name={self.name!r}, "
+            f"outcome={self.outcome!r})"
+        )
+
+    def add_property(self, name: str, value: typing.Optional[str] = None,
+                     text: typing.Optional[str] = None,
+                     items: typing.Optional[list[tuple]] = None) -> None:
+        if self.properties is None:
+            self.properties = []
+        self.properties.append((name, value, text, items))
+
+    def add_evidence_error(self, filename: str,
+                           exception: EvidenceError) -> None:
+        """Note in a ``testrun_evidence_error`` property and in a warning
+        that the evidence ``filename`` is not written into the report"""
+        warnings.warn(EvidenceWarning(
+            f"The test evidence '{filename}' of '{self.name}' is not written "
+            f"into the report: {exception}"
+        ))
+        self.add_property(
+            "testrun_evidence_error", value=filename, text=f"{exception}"
+        )
+
+    def check_evidence(self) -> None:
+        """Replace evidence which cannot be read by empty ``<item>`` nodes
+
+        Called right before the testcase is serialized, so that a missing
+        evidence does not break the report.
+        """
+        for name_, _, _, items_ in list(self.properties or ()):
+            if name_ != "testrun_evidence":
+                continue
+            for index_, (item_name_, evidence_, _) in enumerate(items_):
+                if evidence_ is None:
+                    continue
+                try:
+                    evidence_.check()
+                except EvidenceError as exception:
+                    items_[index_] = (item_name_, None, None)
+                    self.add_evidence_error(item_name_, exception)
+
+    def get_attributes(self) -> dict[str, str]:
+        result = {"classname": "", "name": self.name}
+        if self.file is not None:
+            result["file"] = self.file
+            result["line"] = f"{self.line}"
+        result["duration"] = f"{self.duration}"
+        return result
+
+    def to_element(self) -> Element:
+        self.check_evidence()
+        result = Element("testcase", self.get_attributes())
+        if self.outcome == "failure":
+            failure_node = Element("failure")
+            failure_node.text = self.text
+            result.append(failure_node)
+        elif self.outcome == "skipped":
+            result.append(Element("skipped", message=self.message))
+        elif self.outcome == "error":
+            result.append(Element("error", message=self.message))
+        if self.system_out is not None:
+            stdout_node = Element("system-out")
+            stdout_node.text = self.system_out
+            result.append(stdout_node)
+        if self.system_err is not None:
+            stderr_node = Element("system-err")
+            stderr_node.text = self.system_err
+            result.append(stderr_node)
+        if self.properties:
+            properties_node = Element("properties")
+            for name_, value_, text_, items_ in self.properties:
+                property_node = Element("property", name=name_)
+                if value_ is not None:
+                    property_node.set("value", value_)
+                property_node.text = text_
+                for item_name_, evidence_, sha256_ in items_ or ():
+                    item_node = Element("item", name=item_name_)
+                    if sha256_ is not None:
+                        item_node.set("sha256", sha256_)
+                    item_node.text = evidence_
+                    property_node.append(item_node)
+                properties_node.append(property_node)
+            result.append(properties_node)
+        return result
@@ -0,0 +1,349 @@
+import typing
+from xml.etree.ElementTree import Element
+
+from .captures import SpooledText
+from .records import ResultRecord
+
+
+INDENT_SPACE = "    "
+SERIALIZERS = ("direct", "etree", "lxml")
+
+Write = typing.Callable[[bytes], object]
+Testcase = typing.Union[Element, ResultRecord]
+
+
+def _escape_cdata(text: str) -> str:
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def _escape_attrib(text: str) -> str:
+    text = _escape_cdata(text)
+    if "\"" in text:
+        text = text.replace("\"", "&quot;")
+    if "\r" in text:
+        text = text.replace("\r", "&#13;")
+    if "\n" in text:
+        text = text.replace("\n", "&#10;")
+    if "\t" in text:
+        text = text.replace("\t", "&#09;")
+    return text
+
+
+def _encode(text: str) -> bytes:
+    return text.encode("UTF-8", errors="xmlcharrefreplace")
+
+
+def get_indentation(space: typing.Optional[str], level: int) -> bytes:
+    """Whitespace before a node at ``level``, nothing for compact output"""
+    if space is None:
+        result = b""
+    else:
+        result = _encode("\n" + space * level)
+    return result
+
+
+def _get_text(element: Element) -> typing.Optional[str]:
+    """Text of ``element`` with recorded test evidence encoded completely"""
+    text = element.text
+    if text is None or isinstance(text, str):
+        result = text
+    elif isinstance(text, SpooledText):
+        result = str(text)
+    else:
+        result = b"".join(text.iter_base64()).decode("ascii")
+    return result
+
+
+class DirectSerializer(object):
+    """Writes elements straight as UTF-8 bytes
+
+    The result is indented like ``ElementTree.indent`` would do it, unless
+    ``space`` is ``None``. Indentation is written along with the nodes. Every
+    value is escaped exactly once, and the byte fragments of tags, attribute
+    names and indentations are computed once per serializer. Texts which are
+    not strings, i.e. recorded test evidence and spooled captured output, are
+    written chunk by chunk.
+    """
+    name = "direct"
+
+    def __init__(self, space: typing.Optional[str] = INDENT_SPACE) -> None:
+        self.space = space
+        self._start_tags = {}
+        self._end_tags = {}
+        self._attribute_names = {}
+        self._indentations = []
+
+    def _get_start_tag(self, tag: str) -> bytes:
+        result = self._start_tags.get(tag)
+        if result is None:
+            result = self._start_tags[tag] = _encode(f"<{tag}")
+        return result
+
+    def _get_end_tag(self, tag: str) -> bytes:
+        result = self._end_tags.get(tag)
+        if result is None:
+            result = self._end_tags[tag] = _encode(f"</{tag}>")
+        return result
+
+    def _get_attribute_name(self, name: str) -> bytes:
+        result = self._attribute_names.get(name)
+        if result is None:
+            result = self._attribute_names[name] = _encode(f" {name}=\"")
+        return result
+
+    def _get_indentation(self, level: int) -> bytes:
+        while len(self._indentations) <= level:
+            self._indentations.append(
+                get_indentation(self.space, len(self._indentations))
+            )
+        result = self._indentations[level]
+        return result
+
+    def write_testcase(self, write: Write, testcase: Testcase,
+                       level: int = 0) -> None:
+        if isinstance(testcase, ResultRecord):
+            self.write_record(write, testcase, level)
+        else:
+            self.write_element(write, testcase, level)
+
+    def write_element(self, write: Write, element: Element,
+                      level: int = 0) -> None:
+        parts = []
+        self._serialize(write, element, level, parts)
+        write(b"".join(parts))
+
+    def _append_start_tag(self, parts: list[bytes], tag: str,
+                          attributes: dict[str, str]) -> None:
+        parts.append(self._get_start_tag(tag))
+        for name_, value_ in attributes.items():
+            parts.append(self._get_attribute_name(name_))
+            parts.append(_encode(_escape_attrib(value_)))
+            parts.append(b"\"")
+
+    def _append_text_element(self, parts: list[bytes], tag: str,
+                             text: typing.Optional[str]) -> None:
+        parts.append(self._get_start_tag(tag))
+        if text:
+            parts.append(b">")
+            parts.append(_encode(_escape_cdata(text)))
+            parts.append(self._get_end_tag(tag))
+        else:
+            parts.append(b" />")
+
+    def _write_spooled_text(self, write: Write, parts: list[bytes],
+                            text: SpooledText) -> None:
+        write(b"".join(parts))
+        parts.clear()
+        for chunk_ in text.iter_text():
+            write(_encode(_escape_cdata(chunk_)))
+
+    def _append_captured_output(self, write: Write, parts: list[bytes],
+                                tag: str, text) -> None:
+        if isinstance(text, SpooledText) and len(text):
+            parts.append(self._get_start_tag(tag))
+            parts.append(b">")
+            self._write_spooled_text(write, parts, text)
+            parts.append(self._get_end_tag(tag))
+        else:
+            self._append_text_element(parts, tag, text)
+
+    def write_record(self, write: Write, record: ResultRecord,
+                     level: int = 0) -> None:
+        """Same output as ``write_element(write, record.to_element())``"""
+        record.check_evidence()
+        parts = []
+        self._append_start_tag(parts, "testcase", record.get_attributes())
+        has_outcome_node = record.outcome in ("failure", "skipped", "error")
+        if not (has_outcome_node or record.system_out is not None
+                or record.system_err is not None or record.properties):
+            parts.append(b" />")
+            write(b"".join(parts))
+            return
+        parts.append(b">")
+        indentations = [
+            self._get_indentation(level_)
+            for level_ in range(level, level + 4)
+        ]
+        if record.outcome == "failure":
+            parts.append(indentations[1])
+            self._append_text_element(parts, "failure", record.text)
+        elif has_outcome_node:
+            parts.append(indentations[1])
+            self._append_start_tag(
+                parts, record.outcome, {"message": record.message}
+            )
+            parts.append(b" />")
+        if record.system_out is not None:
+            parts.append(indentations[1])
+            self._append_captured_output(
+                write, parts, "system-out", record.system_out
+            )
+        if record.system_err is not None:
+            parts.append(indentations[1])
+            self._append_captured_output(
+                write, parts, "system-err", record.system_err
+            )
+        if record.properties:
+            parts.append(indentations[1])
+            parts.append(b"<properties>")
+            for name_, value_, text_, items_ in record.properties:
+                parts.append(indentations[2])
+                attributes = {"name": name_}
+                if value_ is not None:
+                    attributes["value"] = value_
+                if items_:
+                    self._append_start_tag(parts, "property", attributes)
+                    parts.append(b">")
+                    for item_name_, evidence_, sha256_ in items_:
+                        parts.append(indentations[3])
+                        attributes = {"name": item_name_}
+                        if sha256_ is not None:
+                            attributes["sha256"] = sha256_
+                        self._append_start_tag(parts, "item", attributes)
+                        if evidence_ is None:
+                            parts.append(b" />")
+                            continue
+                        parts.append(b">")
+                        write(b"".join(parts))
+                        parts.clear()
+                        for chunk_ in evidence_.iter_base64():
+                            write(chunk_)
+                        parts.append(b"</item>")
+                    parts.append(indentations[2])
+                    parts.append(b"</property>")
+                elif text_:
+                    self._append_start_tag(parts, "property", attributes)
+                    parts.append(b">")
+                    parts.append(_encode(_escape_cdata(text_)))
+                    parts.append(b"</property>")
+                else:
+                    self._append_start_tag(parts, "property", attributes)
+                    parts.append(b" />")
+            parts.append(indentations[1])
+            parts.append(b"</properties>")
+        parts.append(indentations[0])
+        parts.append(b"</testcase>")
+        write(b"".join(parts))
+
+    def _serialize(self, write: Write, element: Element, level: int,
+                   parts: list[bytes]) -> None:
+        self._append_start_tag(parts, element.tag, element.attrib)
+        text = element.text
+        if not text and len(element) == 0:
+            parts.append(b" />")
+            return
+        parts.append(b">")
+        if isinstance(text, str):
+            parts.append(_encode(_escape_cdata(text)))
+        elif isinstance(text, SpooledText):
+            self._write_spooled_text(write, parts, text)
+        elif text is not None:
+            write(b"".join(parts))
+            parts.clear()
+            for chunk_ in text.iter_base64():
+                write(chunk_)
+        if len(element):
+            child_indentation = self._get_indentation(level + 1)
+            for child_ in element:
+                parts.append(child_indentation)
+                self._serialize(write, child_, level + 1, parts)
+            parts.append(self._get_indentation(level))
+        parts.append(self._get_end_tag(element.tag))
+
+
+class EtreeSerializer(object):
+    """Writes elements with ``xml.etree.ElementTree``
+
+    Recorded test evidence is encoded completely in memory.
+    """
+    name = "etree"
+
+    def __init__(self, space: typing.Optional[str] = INDENT_SPACE) -> None:
+        from xml.etree import ElementTree
+
+        self.space = space
+        self._element_tree = ElementTree
+
+    def write_testcase(self, write: Write, testcase: Testcase,
+                       level: int = 0) -> None:
+        if isinstance(testcase, ResultRecord):
+            testcase = testcase.to_element()
+        self.write_element(write, testcase, level)
+
+    def write_element(self, write: Write, element: Element,
+                      level: int = 0) -> None:
+        for element_ in element.iter():
+            element_.text = _get_text(element_)
+        if self.space is not None:
+            self._element_tree.indent(element, space=self.space, level=level)
+        write(self._element_tree.tostring(element, encoding="UTF-8",
+                                          xml_declaration=False))
+
+
+class LxmlSerializer(object):
+    """Writes elements with ``lxml``, which must be installed
+
+    Recorded test evidence is encoded completely in memory.
+    """
+    name = "lxml"
+
+    def __init__(self, space: typing.Optional[str] = INDENT_SPACE) -> None:
+        try:
+            from lxml import etree
+        except ImportError as exception:
+            raise ImportError(
+                "The 'lxml' serializer requires lxml: "
+                "python -m pip install lxml"
+            ) from exception
+        self.space = space
+        self._etree = etree
+
+    def write_testcase(self, write: Write, testcase: Testcase,
+                       level: int = 0) -> None:
+        if isinstance(testcase, ResultRecord):
+            testcase = testcase.to_element()
+        self.write_element(write, testcase, level)
+
+    def _convert(self, element: Element, parent=None):
+        if parent is None:
+            result = self._etree.Element(element.tag, element.attrib)
+        else:
+            result = self._etree.SubElement(
+                parent, element.tag, element.attrib
+            )
+        result.text = _get_text(element)
+        for child_ in element:
+            self._convert(child_, result)
+        return result
+
+    def write_element(self, write: Write, element: Element,
+                      level: int = 0) -> None:
+        lxml_element = self._convert(element)
+        if self.space is not None:
+            self._etree.indent(lxml_element, space=self.space, level=level)
+        write(self._etree.tostring(lxml_element, encoding="UTF-8"))
+
+
+def get_serializer(name: str, space: typing.Optional[str] = INDENT_SPACE):
+    """
+    :param name: one of direct|etree|lxml
+    :param space: indentation per level, ``None`` for compact output
+    """
+    if name == "direct":
+        result = DirectSerializer(space)
+    elif name == "etree":
+        result = EtreeSerializer(space)
+    elif name == "lxml":
+        result = LxmlSerializer(space)
+    else:
+        raise ValueError(
+            f"Unknown serializer '{name}', expected one of "
+            f"{'|'.join(SERIALIZERS)}"
+        )
+    return result
@@ -0,0 +1,66 @@
+class ReportStats(object):
+    """Running counters of the testcases written to the report
+
+    The counters are updated for every testcase, so the summary of the
+    ``<test_suite>`` node is available at any time without looking at the
+    testcases again.
+    """
+    OUTCOMES = ("passed", "failure", "skipped", "error")
+
+    def __init__(self) -> None:
+        self.tests = 0
+        self.passed = 0
+        self.failures = 0
+        self.skipped = 0
+        self.errors = 0
+        self.durations = {"setup": 0.0, "call": 0.0, "teardown": 0.0}
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(tests={self.tests}, "
+            f"failures={self.failures}, skipped={self.skipped}, "
+            f"errors={self.errors})"
+        )
+
+    def add_testcase(self, outcome: str) -> None:
+        """
+        :param outcome: one of passed|failure|skipped|error
+        """
+        if outcome == "passed":
+            self.passed += 1
+        elif outcome == "failure":
+            self.failures += 1
+        elif outcome == "skipped":
+            self.skipped += 1
+        elif outcome == "error":
+            self.errors += 1
+        else:
+            raise ValueError(
+                f"Unknown outcome '{outcome}', expected one of "
+                f"{'|'.join(self.OUTCOMES)}"
+            )
+        self.tests += 1
+
+    def add_duration(self, when: str, duration: float) -> None:
+        self.durations[when] = self.durations.get(when, 0.0) + duration
+
+    def to_dict(self) -> dict:
+        result = {
+            "tests": self.tests,
+            "passed": self.passed,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "durations": dict(self.durations),
+        }
+        return result
+
+    def update(self, other: dict) -> None:
+        """Add the counters of ``other``, as returned by :meth:`to_dict`"""
+        self.tests += other["tests"]
+        self.passed += other["passed"]
+        self.failures += other["failures"]
+        self.skipped += other["skipped"]
+        self.errors += other["errors"]
+        for when_, duration_ in other["durations"].items():
+            self.add_duration(when_, duration_)
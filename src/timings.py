@@ -0,0 +1,97 @@
+import heapq
+import itertools
+import typing
+from xml.etree.ElementTree import Element
+
+
+PHASES = ("setup", "call", "teardown")
+
+
+class SlowestTimings(object):
+    """The slowest tests and fixtures of the session
+
+    Of the tests, only the ``size`` slowest are kept, by their total duration
+    of setup, call and teardown. Fixtures are added up by name over all their
+    setups, since the same fixture may be set up for many tests.
+    """
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._tests = []
+        self._fixtures = {}
+        # breaks ties, so that the durations are never compared
+        self._counter = itertools.count()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(size={self.size})"
+
+    def add_test(self, nodeid: str, durations: dict[str, float]) -> None:
+        entry = (sum(durations.values()), nodeid, next(self._counter),
+                 durations)
+        if len(self._tests) < self.size:
+            heapq.heappush(self._tests, entry)
+        elif entry > self._tests[0]:
+            heapq.heapreplace(self._tests, entry)
+
+    def add_fixture(self, name: str, duration: float, count: int = 1) -> None:
+        total_duration, total_count = self._fixtures.get(name, (0.0, 0))
+        self._fixtures[name] = (total_duration + duration, total_count + count)
+
+    def get_slowest_tests(self) -> list[tuple[float, str, dict]]:
+        result = [
+            (duration_, nodeid_, durations_)
+            for duration_, nodeid_, _, durations_
+            in sorted(self._tests, reverse=True)
+        ]
+        return result
+
+    def get_slowest_fixtures(self) -> list[tuple[str, float, int]]:
+        result = heapq.nlargest(
+            self.size,
+            ((name_, duration_, count_)
+             for name_, (duration_, count_) in self._fixtures.items()),
+            key=lambda fixture_: fixture_[1]
+        )
+        return result
+
+    def to_dict(self) -> dict:
+        result = {
+            "tests": [
+                [nodeid_, durations_]
+                for _, nodeid_, _, durations_ in self._tests
+            ],
+            "fixtures": {
+                name_: list(fixture_)
+                for name_, fixture_ in self._fixtures.items()
+            },
+        }
+        return result
+
+    def update(self, other: dict) -> None:
+        """Add the timings of ``other``, as returned by :meth:`to_dict`"""
+        for nodeid_, durations_ in other["tests"]:
+            self.add_test(nodeid_, durations_)
+        for name_, (duration_, count_) in other["fixtures"].items():
+            self.add_fixture(name_, duration_, count_)
+
+    def to_element(self) -> typing.Optional[Element]:
+        """``<properties>`` of the ``<test_suite>``, ``None`` if empty"""
+        if not (self._tests or self._fixtures):
+            return None
+        result = Element("properties")
+        tests_node = Element("property", name="slowest_tests")
+        for duration_, nodeid_, durations_ in self.get_slowest_tests():
+            attributes = {"name": nodeid_, "duration": f"{duration_}"}
+            for phase_ in PHASES:
+                if phase_ in durations_:
+                    attributes[f"{phase_}_duration"] = f"{durations_[phase_]}"
+            tests_node.append(Element("item", attributes))
+        result.append(tests_node)
+        fixtures_node = Element("property", name="slowest_fixtures")
+        for name_, duration_, count_ in self.get_slowest_fixtures():
+            fixtures_node.append(Element("item", {
+                "name": name_,
+                "duration": f"{duration_}",
+                "count": f"{count_}",
+            }))
+        result.append(fixtures_node)
+        return result
@@ -6,3 +6,11 @@ def find_items_from_user_properties(user_properties: list[tuple],
         if name_ == name
     ]
     return result
+
+
+def index_user_properties(user_properties: list[tuple]) -> dict[str, list]:
+    """Group the items of ``user_properties`` by name in a single pass"""
+    result = {}
+    for name_, item_ in user_properties:
+        result.setdefault(name_, []).append(item_)
+    return result
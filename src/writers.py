@@ -0,0 +1,435 @@
+import json
+import os
+import platform
+import queue
+import shutil
+import threading
+import time
+import typing
+import warnings
+from xml.etree.ElementTree import Element
+from xml.sax.saxutils import quoteattr
+
+from .compressors import compress, open_input, open_output, split_extension
+from .defaults import DEFAULT_QUEUE_SIZE
+from .exceptions import ReportWarning
+from .serializers import (
+    INDENT_SPACE,
+    DirectSerializer,
+    Testcase,
+    get_indentation
+)
+from .stats import ReportStats
+
+
+XML_DECLARATION = b"<?xml version='1.0' encoding='UTF-8'?>\n"
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def get_suite_attributes(stats: ReportStats,
+                         suite_time: float) -> dict[str, str]:
+    result = {
+        "name": "pytest",
+        "tests": f"{stats.tests}",
+        "time": f"{suite_time:.3f}",
+        "hostname": platform.node(),
+        "failures": f"{stats.failures}",
+        "skipped": f"{stats.skipped}",
+        "errors": f"{stats.errors}",
+    }
+    return result
+
+
+def _get_start_tag(attributes: dict[str, str]) -> str:
+    result = "<test_suite" + "".join(
+        f" {name_}={quoteattr(value_)}"
+        for name_, value_ in attributes.items()
+    )
+    return result
+
+
+def get_header(serializer, properties: typing.Optional[Element]) -> bytes:
+    """Serialized ``<properties>`` of the ``<test_suite>``, if any"""
+    if properties is None:
+        result = b""
+    else:
+        parts = [get_indentation(serializer.space, 1)]
+        serializer.write_element(parts.append, properties, level=1)
+        result = b"".join(parts)
+    return result
+
+
+class TreeWriter(object):
+    """Keeps all testcases in memory and writes them at the end"""
+    def __init__(self, xmlfile: str, serializer=None,
+                 compression: str = "none",
+                 compression_level: typing.Optional[int] = None) -> None:
+        self.xmlfile = xmlfile
+        self.serializer = serializer or DirectSerializer()
+        self.compression = compression
+        self.compression_level = compression_level
+        self.testcases = []
+
+    def add_testcase(self, testcase: Testcase, outcome: str) -> None:
+        self.testcases.append(testcase)
+
+    def close(self, attributes: dict[str, str],
+              properties: typing.Optional[Element] = None) -> None:
+        os.makedirs(os.path.dirname(self.xmlfile), exist_ok=True)
+        start_tag = _get_start_tag(attributes).encode("UTF-8")
+        header = get_header(self.serializer, properties)
+        indentation = get_indentation(self.serializer.space, 1)
+        with open_output(self.xmlfile, self.compression,
+                         self.compression_level) as xmlfile:
+            xmlfile.write(XML_DECLARATION)
+            if not (self.testcases or header):
+                xmlfile.write(start_tag + b" />")
+            else:
+                xmlfile.write(start_tag + b">" + header)
+                for testcase_ in self.testcases:
+                    xmlfile.write(indentation)
+                    self.serializer.write_testcase(
+                        xmlfile.write, testcase_, level=1
+                    )
+                xmlfile.write(get_indentation(self.serializer.space, 0))
+                xmlfile.write(b"</test_suite>")
+
+
+def write_report(xmlfile: str, attributes: dict[str, str],
+                 body_file_names: typing.Iterable[str],
+                 space: typing.Optional[str] = INDENT_SPACE,
+                 compression: str = "none",
+                 compression_level: typing.Optional[int] = None,
+                 header: bytes = b"") -> None:
+    """Assemble the report from the serialized testcases in the body files
+
+    The body files are compressed with ``compression`` already, see
+    :class:`FragmentWriter`, so they are copied as they are between a gzip
+    member, or zstd frame, of the start tag and one of the end tag.
+
+    :param space: indentation the body files were written with, ``None`` for
+        compact output
+    :param compression: one of none|gzip|zstd, see
+        :func:`pytest_junit_xray_xml.compressors.open_output`
+    :param header: serialized nodes before the testcases, see
+        :func:`get_header`
+    """
+    start_tag = _get_start_tag(attributes).encode("UTF-8")
+    body_file_names = list(body_file_names)
+    with open(xmlfile, "wb") as xmlfile_:
+        if header or body_file_names:
+            xmlfile_.write(compress(
+                XML_DECLARATION + start_tag + b">" + header, compression,
+                compression_level
+            ))
+            for body_file_name_ in body_file_names:
+                with open(body_file_name_, "rb") as body_file:
+                    shutil.copyfileobj(body_file, xmlfile_)
+            xmlfile_.write(compress(
+                get_indentation(space, 0) + b"</test_suite>", compression,
+                compression_level
+            ))
+        else:
+            xmlfile_.write(compress(
+                XML_DECLARATION + start_tag + b" />", compression,
+                compression_level
+            ))
+
+
+class FragmentWriter(object):
+    """Serializes every testcase to a body file as soon as it is added
+
+    The body file is written through the compressor of ``compression``, so
+    the report can be assembled from it without compressing it again, see
+    :func:`write_report`. A testcase whose serialization fails is removed
+    from the body file again, so that the body file stays valid.
+    """
+    def __init__(self, body_file_name: str, serializer=None,
+                 compression: str = "none",
+                 compression_level: typing.Optional[int] = None) -> None:
+        self.body_file_name = body_file_name
+        self.serializer = serializer or DirectSerializer()
+        self.compression = compression
+        self.compression_level = compression_level
+        self._body_file = None
+        self._indentation = get_indentation(self.serializer.space, 1)
+        self.number_of_testcases = 0
+        # uncompressed
+        self.size = 0
+
+    def _write(self, data: bytes) -> None:
+        self._body_file.write(data)
+        self.size += len(data)
+
+    def _truncate(self, size: int) -> None:
+        if self.compression == "none":
+            self._body_file.seek(size)
+            self._body_file.truncate()
+            return
+        # a compressed stream cannot be truncated, so the body file is
+        # compressed anew up to the failed testcase; only on failures
+        self._body_file.close()
+        temporary_file_name = f"{self.body_file_name}.tmp"
+        with open_input(self.body_file_name) as body_file, \
+                open_output(temporary_file_name, self.compression,
+                            self.compression_level) as temporary_file:
+            remaining = size
+            while remaining:
+                chunk = body_file.read(min(remaining, COPY_CHUNK_SIZE))
+                if not chunk:
+                    break
+                temporary_file.write(chunk)
+                remaining -= len(chunk)
+        os.replace(temporary_file_name, self.body_file_name)
+        self._body_file = open_output(
+            self.body_file_name, self.compression, self.compression_level,
+            mode="ab"
+        )
+
+    def add_testcase(self, testcase: Testcase, outcome: str) -> None:
+        if self._body_file is None:
+            os.makedirs(os.path.dirname(self.body_file_name), exist_ok=True)
+            self._body_file = open_output(
+                self.body_file_name, self.compression, self.compression_level
+            )
+        size = self.size
+        try:
+            self._write(self._indentation)
+            self.serializer.write_testcase(self._write, testcase, level=1)
+        except BaseException:
+            self._truncate(size)
+            self.size = size
+            raise
+        self.number_of_testcases += 1
+
+    def close(self) -> None:
+        if self._body_file is not None:
+            self._body_file.close()
+            self._body_file = None
+
+
+class StreamingWriter(FragmentWriter):
+    """Serializes every testcase as soon as it is added
+
+    The testcases are appended to a body file next to the report. At the end
+    of the session the report is assembled from the ``<test_suite>`` start tag,
+    whose attributes are only known then, and the body file, which is copied
+    over in chunks. Memory usage therefore does not depend on the number of
+    testcases. The body file is compressed already, see
+    :func:`write_report`.
+    """
+    def __init__(self, xmlfile: str, serializer=None,
+                 compression: str = "none",
+                 compression_level: typing.Optional[int] = None) -> None:
+        self.xmlfile = xmlfile
+        super().__init__(
+            f"{xmlfile}.part", serializer, compression, compression_level
+        )
+
+    def close(self, attributes: dict[str, str],
+              properties: typing.Optional[Element] = None) -> None:
+        super().close()
+        body_file_names = [self.body_file_name] \
+            if self.number_of_testcases else []
+        write_report(self.xmlfile, attributes, body_file_names,
+                     self.serializer.space, self.compression,
+                     self.compression_level,
+                     get_header(self.serializer, properties))
+        if os.path.isfile(self.body_file_name):
+            # also if no testcase could be written into it
+            os.remove(self.body_file_name)
+
+
+class MergingWriter(object):
+    """Assembles the report from body files written by other processes"""
+    def __init__(self, xmlfile: str,
+                 space: typing.Optional[str] = INDENT_SPACE,
+                 compression: str = "none",
+                 compression_level: typing.Optional[int] = None) -> None:
+        self.xmlfile = xmlfile
+        self.serializer = DirectSerializer(space)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.body_file_names = []
+
+    def add_body_file(self, body_file_name: str) -> None:
+        self.body_file_names.append(body_file_name)
+
+    def close(self, attributes: dict[str, str],
+              properties: typing.Optional[Element] = None) -> None:
+        write_report(self.xmlfile, attributes, self.body_file_names,
+                     self.serializer.space, self.compression,
+                     self.compression_level,
+                     get_header(self.serializer, properties))
+        for body_file_name_ in self.body_file_names:
+            os.remove(body_file_name_)
+
+
+class ShardedWriter(object):
+    """Splits the report into several standalone reports
+
+    ``report.xml`` is split into ``report.001.xml``, ``report.002.xml``, ...
+    Each shard is written as soon as it holds ``max_tests`` testcases or
+    ``max_bytes`` bytes of serialized testcases, so a shard can exceed
+    ``max_bytes`` by one testcase. The shards are listed in
+    ``report.index.json``. ``max_bytes`` refers to the uncompressed size of
+    a shard. The ``<properties>`` of the whole session are written into the
+    last shard.
+    """
+    def __init__(self, xmlfile: str, max_bytes: typing.Optional[int] = None,
+                 max_tests: typing.Optional[int] = None,
+                 serializer=None, compression: str = "none",
+                 compression_level: typing.Optional[int] = None) -> None:
+        self.xmlfile = xmlfile
+        self.serializer = serializer or DirectSerializer()
+        self.compression = compression
+        self.compression_level = compression_level
+        self.max_bytes = max_bytes
+        self.max_tests = max_tests
+        self.shards = []
+        self._shard = None
+        self._shard_stats = None
+        self._shard_start_time = None
+
+    @property
+    def index_file_name(self) -> str:
+        root, _ = split_extension(self.xmlfile)
+        result = f"{root}.index.json"
+        return result
+
+    def _get_shard_file_name(self, number: int) -> str:
+        root, extension = split_extension(self.xmlfile)
+        result = f"{root}.{number:03d}{extension}"
+        return result
+
+    def _is_shard_full(self) -> bool:
+        result = (
+            (self.max_tests and
+             self._shard.number_of_testcases >= self.max_tests)
+            or (self.max_bytes and self._shard.size >= self.max_bytes)
+        )
+        return bool(result)
+
+    def _open_shard(self) -> None:
+        shard_file_name = self._get_shard_file_name(len(self.shards) + 1)
+        self._shard = FragmentWriter(
+            f"{shard_file_name}.part", self.serializer, self.compression,
+            self.compression_level
+        )
+        self._shard_stats = ReportStats()
+        self._shard_start_time = time.time()
+
+    def _close_shard(self, header: bytes = b"") -> None:
+        self._shard.close()
+        shard_file_name = self._get_shard_file_name(len(self.shards) + 1)
+        attributes = get_suite_attributes(
+            self._shard_stats, time.time() - self._shard_start_time
+        )
+        write_report(shard_file_name, attributes, [self._shard.body_file_name],
+                     self.serializer.space, self.compression,
+                     self.compression_level, header)
+        os.remove(self._shard.body_file_name)
+        self.shards.append({
+            "file": os.path.basename(shard_file_name),
+            "tests": self._shard_stats.tests,
+            "failures": self._shard_stats.failures,
+            "skipped": self._shard_stats.skipped,
+            "errors": self._shard_stats.errors,
+            "bytes": os.path.getsize(shard_file_name),
+        })
+        self._shard = None
+
+    def add_testcase(self, testcase: Testcase, outcome: str) -> None:
+        if self._shard is not None and self._is_shard_full():
+            self._close_shard()
+        if self._shard is None:
+            self._open_shard()
+        self._shard.add_testcase(testcase, outcome)
+        self._shard_stats.add_testcase(outcome)
+
+    def close(self, attributes: dict[str, str],
+              properties: typing.Optional[Element] = None) -> None:
+        if self._shard is not None:
+            self._close_shard(get_header(self.serializer, properties))
+        with open(self.index_file_name, "w", encoding="UTF-8") as index_file:
+            json.dump(
+                {
+                    "tests": int(attributes["tests"]),
+                    "failures": int(attributes["failures"]),
+                    "skipped": int(attributes["skipped"]),
+                    "errors": int(attributes["errors"]),
+                    "time": float(attributes["time"]),
+                    "shards": self.shards,
+                },
+                index_file,
+                indent=4
+            )
+
+
+class ThreadedWriter(object):
+    """Runs another writer in a background thread
+
+    Testcases are put on a queue of at most ``queue_size`` entries, so the
+    test run only waits for the writer when it falls behind by that many
+    testcases. A testcase which cannot be written is left out of the report
+    and the remaining testcases are still written; a :class:`ReportWarning`
+    is shown once in the main thread, the test run goes on.
+    """
+    def __init__(self, writer, queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+        self.writer = writer
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._exception = None
+        self._has_warned = False
+        # outcomes of the testcases left out of the report
+        self._failed_stats = ReportStats()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self.writer.add_testcase(*item)
+            except Exception as exception:
+                self._failed_stats.add_testcase(item[1])
+                if self._exception is None:
+                    self._exception = exception
+
+    def _warn(self) -> None:
+        if self._exception is not None and not self._has_warned:
+            self._has_warned = True
+            warnings.warn(ReportWarning(
+                "Writing the report in the background failed, testcases are "
+                f"left out of the report: {self._exception!r}"
+            ))
+
+    def _get_attributes(self, attributes: dict[str, str]) -> dict[str, str]:
+        # the testcases left out are not counted in the <test_suite>
+        result = dict(attributes)
+        for name_ in ("tests", "failures", "skipped", "errors"):
+            result[name_] = \
+                f"{int(result[name_]) - getattr(self._failed_stats, name_)}"
+        return result
+
+    def add_testcase(self, testcase: Testcase, outcome: str) -> None:
+        self._warn()
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run,
+                name="junit-xray-xml-writer",
+                daemon=True
+            )
+            self._thread.start()
+        self._queue.put((testcase, outcome))
+
+    def close(self, *args, **kwargs) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if args and self._failed_stats.tests:
+            args = (self._get_attributes(args[0]), *args[1:])
+        # the report is assembled from the testcases which were written
+        self.writer.close(*args, **kwargs)
+        self._warn()
@@ -0,0 +1,194 @@
+"""Xray JSON import format
+
+See https://docs.getxray.app/display/XRAYCLOUD/Using+Xray+JSON+format+to+import+execution+results
+"""
+import datetime
+import json
+import mimetypes
+import os
+import typing
+from xml.etree.ElementTree import Element
+
+from .compressors import open_output, split_extension
+from .records import ResultRecord
+from .serializers import INDENT_SPACE, Write, get_indentation
+
+
+REPORT_FORMATS = ("auto", "xml", "json")
+# outcome of a testcase -> Xray status
+XRAY_STATUSES = {
+    "passed": "PASSED",
+    "failure": "FAILED",
+    "error": "FAILED",
+    "skipped": "TODO",
+}
+
+
+def get_report_format(xmlfile: str, report_format: str = "auto") -> str:
+    """
+    :param report_format: one of auto|xml|json, ``auto`` selects ``json``
+        for reports named ``*.json``, optionally compressed
+    :return: one of xml|json
+    """
+    if report_format not in REPORT_FORMATS:
+        raise ValueError(
+            f"Unknown report format '{report_format}', expected one of "
+            f"{'|'.join(REPORT_FORMATS)}"
+        )
+    if report_format == "auto":
+        _, extension = split_extension(xmlfile)
+        result = "json" if extension.lower().startswith(".json") else "xml"
+    else:
+        result = report_format
+    return result
+
+
+def _format_time(timestamp: float) -> str:
+    result = datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc
+    ).isoformat(timespec="seconds")
+    return result
+
+
+def _dump(value) -> bytes:
+    # ASCII only, so that even lone surrogates can be written
+    return json.dumps(value).encode("ascii")
+
+
+class JsonSerializer(object):
+    """Writes a testcase as a test object of the Xray JSON format
+
+    The base64-encoded evidence is written chunk by chunk into the ``data``
+    of the evidence objects. Tests without a test key are only created by
+    Xray if ``project_key`` is given.
+    """
+    name = "json"
+
+    def __init__(self, space: typing.Optional[str] = INDENT_SPACE,
+                 project_key: typing.Optional[str] = None) -> None:
+        self.space = space
+        self.project_key = project_key
+
+    def _get_test(self, record: ResultRecord, finish_time: float) -> dict:
+        properties = {
+            name_: (value_, text_, items_)
+            for name_, value_, text_, items_ in record.properties or ()
+        }
+        result = {}
+        if "test_key" in properties:
+            result["testKey"] = properties["test_key"][0]
+        else:
+            test_info = {
+                "summary": record.name,
+                "type": "Generic",
+            }
+            if self.project_key:
+                test_info["projectKey"] = self.project_key
+            if "test_summary" in properties:
+                test_info["summary"] = properties["test_summary"][0]
+            if "test_description" in properties:
+                test_info["definition"] = properties["test_description"][1]
+            result["testInfo"] = test_info
+        result["start"] = _format_time(finish_time - record.duration)
+        result["finish"] = _format_time(finish_time)
+        result["status"] = XRAY_STATUSES[record.outcome]
+        comment = record.text if record.outcome == "failure" \
+            else record.message
+        if comment:
+            result["comment"] = comment
+        return result
+
+    def write_testcase(self, write: Write, testcase: ResultRecord,
+                       level: int = 1,
+                       finish_time: typing.Optional[float] = None) -> None:
+        if isinstance(testcase, Element):
+            raise TypeError("The Xray JSON format requires ResultRecords")
+        if finish_time is None:
+            finish_time = datetime.datetime.now().timestamp()
+        testcase.check_evidence()
+        test = self._get_test(testcase, finish_time)
+        evidence_items = [
+            (item_name_, evidence_)
+            for name_, _, _, items_ in testcase.properties or ()
+            if name_ == "testrun_evidence"
+            for item_name_, evidence_, _ in items_
+            # evidence which could not be read is left out
+            if evidence_ is not None
+        ]
+        if not evidence_items:
+            write(_dump(test))
+            return
+        # the evidence is appended to the object without its closing brace
+        write(_dump(test)[:-1])
+        write(b", \"evidence\": [")
+        for index_, (filename_, evidence_) in enumerate(evidence_items):
+            if index_:
+                write(b", ")
+            write(b"{\"filename\": " + _dump(filename_))
+            content_type, _ = mimetypes.guess_type(filename_)
+            if content_type:
+                write(b", \"contentType\": " + _dump(content_type))
+            write(b", \"data\": \"")
+            for chunk_ in evidence_.iter_base64():
+                write(chunk_)
+            write(b"\"}")
+        write(b"]}")
+
+
+class XrayJsonWriter(object):
+    """Writes the Xray JSON report as a stream
+
+    Every test object is written as soon as it is added. The ``info`` of the
+    test execution is only known at the end, so it follows the ``tests``.
+    The ``<properties>`` of the suite have no counterpart in the Xray JSON
+    format and are ignored.
+    """
+    def __init__(self, xmlfile: str, serializer: JsonSerializer = None,
+                 compression: str = "none",
+                 compression_level: typing.Optional[int] = None) -> None:
+        self.xmlfile = xmlfile
+        self.serializer = serializer or JsonSerializer()
+        self.compression = compression
+        self.compression_level = compression_level
+        self.number_of_testcases = 0
+        self._output_file = None
+        self._indentation = get_indentation(self.serializer.space, 1)
+
+    def _open(self) -> None:
+        os.makedirs(os.path.dirname(self.xmlfile), exist_ok=True)
+        self._output_file = open_output(
+            self.xmlfile, self.compression, self.compression_level
+        )
+        self._output_file.write(b"{\"tests\": [")
+
+    def add_testcase(self, testcase: ResultRecord, outcome: str) -> None:
+        if self._output_file is None:
+            self._open()
+        if self.number_of_testcases:
+            self._output_file.write(b",")
+        self._output_file.write(self._indentation)
+        self.serializer.write_testcase(self._output_file.write, testcase)
+        self.number_of_testcases += 1
+
+    def close(self, attributes: dict[str, str],
+              properties: typing.Optional[Element] = None) -> None:
+        if self._output_file is None:
+            self._open()
+        finish_time = datetime.datetime.now().timestamp()
+        info = {
+            "summary": (
+                f"{attributes['name']}: {attributes['tests']} tests, "
+                f"{attributes['failures']} failures, "
+                f"{attributes['errors']} errors, "
+                f"{attributes['skipped']} skipped"
+            ),
+            "startDate": _format_time(finish_time - float(attributes["time"])),
+            "finishDate": _format_time(finish_time),
+        }
+        if self.serializer.project_key:
+            info["project"] = self.serializer.project_key
+        if self.number_of_testcases:
+            self._output_file.write(get_indentation(self.serializer.space, 0))
+        self._output_file.write(b"], \"info\": " + _dump(info) + b"}")
+        self._output_file.close()
+        self._output_file = None
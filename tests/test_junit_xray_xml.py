@@ -1,7 +1,18 @@
 import base64
+# imported before pytester, which removes the modules imported by a run
+# afterwards, while concurrent.futures keeps ProcessPoolExecutor
+import concurrent.futures.process  # noqa: F401
+import gzip
+import hashlib
+import json
 import logging
+import subprocess
+import sys
+import time
 import xml.etree.ElementTree as ET
 
+import pytest
+
 from _pytest.pytester import Pytester
 
 logger = logging.getLogger(__name__)
@@ -185,3 +196,1658 @@ def test_record_test_evidence_xml(pytester: Pytester):
     xml_content = ET.Element("my_root", my_attribute="1")
     expected_evidence = ET.canonicalize(ET.tostring(xml_content))
     assert actual_evidence == expected_evidence
+
+
+def test_streaming(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import record_test_key
+
+    def test_pass(record_test_key):
+        record_test_key("JIRA-1234")
+        assert True
+
+    def test_fail():
+        assert False
+
+    @pytest.mark.skip(reason="skipped on purpose")
+    def test_skip():
+        pass
+
+    def test_skip_in_call():
+        pytest.skip("skipped on purpose")
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_streaming = true
+    """)
+    _, root_node = run_and_parse(pytester, None)
+    assert root_node.tag == "test_suite"
+    assert root_node.attrib["tests"] == "3"
+    assert root_node.attrib["failures"] == "1"
+    assert root_node.attrib["skipped"] == "1"
+    assert root_node.attrib["errors"] == "0"
+    actual_key = root_node.find(
+        "./testcase[@name='test_pass']/properties/property[@name='test_key']"
+    )
+    assert actual_key.attrib["value"] == "JIRA-1234"
+    assert not list(pytester.path.glob("*.part"))
+
+
+def test_streaming_matches_in_memory_report(pytester: Pytester):
+    pytester.makepyfile("""
+    from pytest_junit_xray_xml import record_test_description
+
+    def test_pass(record_test_description):
+        record_test_description("line 1")
+        record_test_description("line 2")
+
+    def test_fail():
+        assert False
+    """)
+    xml_path = pytester.path / "xray.xml"
+    pytester.runpytest(f"--junitxrayxml={xml_path}")
+    in_memory_report = xml_path.read_text(encoding="UTF-8")
+    pytester.runpytest(
+        f"--junitxrayxml={xml_path}", "-o", "junit_xray_streaming=true"
+    )
+    streamed_report = xml_path.read_text(encoding="UTF-8")
+
+    def _without_time(report):
+        return [
+            line_ for line_ in report.splitlines()
+            if "<test_suite" not in line_ and "duration=" not in line_
+        ]
+    assert _without_time(streamed_report) == _without_time(in_memory_report)
+
+
+def test_report_stats(pytester: Pytester):
+    pytester.makeconftest("""
+    def pytest_terminal_summary(terminalreporter, config):
+        stats = config._junitxray.stats
+        terminalreporter.write_line(f"junitxray stats: {stats!r}")
+        terminalreporter.write_line(
+            f"junitxray setup: {stats.durations['setup'] > 0}"
+        )
+    """)
+    pytester.makepyfile("""
+    import time
+    import pytest
+
+    @pytest.fixture
+    def slow_fixture():
+        time.sleep(0.01)
+
+    def test_pass(slow_fixture):
+        pass
+
+    def test_fail():
+        assert False
+
+    @pytest.fixture
+    def broken_fixture():
+        raise ValueError("broken")
+
+    def test_error(broken_fixture):
+        pass
+
+    def test_skip():
+        pytest.skip("skipped on purpose")
+    """)
+    result, root_node = run_and_parse(pytester, None)
+    result.stdout.fnmatch_lines([
+        "junitxray stats: ReportStats(tests=4, failures=1, skipped=1, "
+        "errors=1)",
+        "junitxray setup: True",
+    ])
+    assert root_node.attrib["tests"] == "4"
+    assert root_node.attrib["failures"] == "1"
+    assert root_node.attrib["skipped"] == "1"
+    assert root_node.attrib["errors"] == "1"
+
+
+def test_record_test_evidence_spooled(pytester: Pytester):
+    pytester.makepyfile("""
+    from pytest_junit_xray_xml import record_test_evidence
+
+    def test_record_test_evidence(record_test_evidence):
+        with record_test_evidence("large.bin", "wb") as f:
+            for index_ in range(1000):
+                f.write(bytes(range(index_ % 256)) * 3)
+        assert f.size > 10
+        assert f._path is not None
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_evidence_spool_size = 10
+    """)
+    result, root_node = run_and_parse(pytester, None)
+    result.assert_outcomes(passed=1)
+    actual_evidence = base64.b64decode(
+        root_node.find(
+            "./testcase/properties"
+            "/property[@name='testrun_evidence']/item[@name='large.bin']"
+        ).text
+    )
+    expected_evidence = b"".join(
+        bytes(range(index_ % 256)) * 3 for index_ in range(1000)
+    )
+    assert actual_evidence == expected_evidence
+
+
+def test_record_test_evidence_file(pytester: Pytester):
+    file_content = b"\x89PNG not really a screenshot" * 10000
+    pytester.path.joinpath("screenshot.png").write_bytes(file_content)
+    pytester.path.joinpath("empty.txt").write_bytes(b"")
+    pytester.makepyfile("""
+    from pytest_junit_xray_xml import record_test_evidence_file
+
+    def test_record_test_evidence_file(record_test_evidence_file):
+        record_test_evidence_file("screenshot.png")
+        record_test_evidence_file("empty.txt", "renamed.txt")
+    """)
+    _, root_node = run_and_parse(pytester, None)
+    evidence_node = root_node.find(
+        "./testcase/properties/property[@name='testrun_evidence']"
+    )
+    actual_evidence = evidence_node.find("./item[@name='screenshot.png']")
+    assert base64.b64decode(actual_evidence.text) == file_content
+    renamed_evidence = evidence_node.find("./item[@name='renamed.txt']")
+    assert renamed_evidence is not None
+    assert not renamed_evidence.text
+
+
+def test_record_test_evidence_file_missing(pytester: Pytester):
+    pytester.makepyfile("""
+    from pytest_junit_xray_xml import record_test_evidence_file
+
+    def test_record_test_evidence_file(record_test_evidence_file):
+        record_test_evidence_file("missing.png")
+    """)
+    result, _ = run_and_parse(pytester, None)
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(
+        "*FileNotFoundError: Cannot record test evidence*missing.png*"
+    )
+
+
+@pytest.mark.parametrize("serializer", ["direct", "etree"])
+def test_record_test_evidence_file_removed(pytester: Pytester,
+                                           serializer: str):
+    pytester.path.joinpath("early.txt").write_bytes(b"early")
+    pytester.path.joinpath("late.txt").write_bytes(b"late")
+    pytester.makepyfile("""
+    import os
+
+    from pytest_junit_xray_xml import record_test_evidence_file
+
+    def test_first(record_test_evidence_file):
+        record_test_evidence_file("late.txt")
+
+    def test_second(record_test_evidence_file):
+        record_test_evidence_file("early.txt")
+        os.remove("early.txt")
+
+    def test_third():
+        os.remove("late.txt")
+        assert False
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_serializer = {serializer}
+    """)
+    result, root_node = run_and_parse(pytester, None)
+    result.assert_outcomes(passed=2, failed=1)
+    result.stdout.fnmatch_lines([
+        "*EvidenceWarning: The test evidence 'early.txt' of 'test_second' *",
+        "*EvidenceWarning: The test evidence 'late.txt' of 'test_first' *",
+    ])
+    assert [node_.attrib["name"] for node_ in root_node] == [
+        "test_first", "test_second", "test_third"
+    ]
+    assert root_node.find("./testcase[@name='test_third']/failure") \
+        is not None
+    for name_, filename_ in [("test_first", "late.txt"),
+                             ("test_second", "early.txt")]:
+        testcase = root_node.find(f"./testcase[@name='{name_}']")
+        item_node = testcase.find(
+            f".//property[@name='testrun_evidence']/item[@name='{filename_}']"
+        )
+        assert not item_node.text
+        error_node = testcase.find(
+            ".//property[@name='testrun_evidence_error']"
+        )
+        assert error_node.attrib["value"] == filename_
+        assert "has been removed" in error_node.text
+
+
+def test_xdist(pytester: Pytester):
+    pytest.importorskip("xdist")
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import record_test_evidence
+
+    @pytest.mark.parametrize("index", range(10))
+    def test_record_test_evidence(record_test_evidence, index):
+        with record_test_evidence(f"file{index}.txt", "w") as f:
+            f.write(f"content {index}")
+        assert index != 3
+
+    def test_skip():
+        pytest.skip("skipped on purpose")
+    """)
+    xml_path = pytester.path / "xray.xml"
+    result = pytester.runpytest(f"--junitxrayxml={xml_path}", "-n", "2")
+    result.assert_outcomes(passed=9, failed=1, skipped=1)
+    root_node = ET.parse(str(xml_path)).getroot()
+    assert root_node.attrib["tests"] == "11"
+    assert root_node.attrib["failures"] == "1"
+    assert root_node.attrib["skipped"] == "1"
+    assert len(root_node.findall("./testcase")) == 11
+    for index_ in range(10):
+        actual_evidence = root_node.find(
+            "./testcase/properties/property[@name='testrun_evidence']"
+            f"/item[@name='file{index_}.txt']"
+        ).text
+        assert base64.b64decode(actual_evidence) == f"content {index_}".encode()
+    assert not list(pytester.path.glob("*.part"))
+
+
+def test_xdist_without_report(pytester: Pytester):
+    pytest.importorskip("xdist")
+    pytester.path.joinpath("screenshot.png").write_bytes(b"\x89PNG")
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import (
+        record_test_evidence,
+        record_test_evidence_file
+    )
+
+    @pytest.mark.parametrize("index", range(4))
+    def test_record_test_evidence(record_test_evidence,
+                                  record_test_evidence_file, index):
+        with record_test_evidence(f"file{index}.txt", "w") as f:
+            f.write(f"content {index}")
+        record_test_evidence_file("screenshot.png")
+        record_test_evidence("deferred.txt", lambda: b"deferred")
+    """)
+    result = pytester.runpytest("-n", "2")
+    result.assert_outcomes(passed=4)
+    result.stdout.no_fnmatch_line("*INTERNALERROR*")
+
+
+@pytest.mark.parametrize("policy", ["no", "cache"])
+def test_evidence_deduplication_cache(pytester: Pytester, policy: str):
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import record_test_evidence
+
+    @pytest.mark.parametrize("index", range(3))
+    def test_record_test_evidence(record_test_evidence, index):
+        with record_test_evidence("reference.txt", "w") as f:
+            f.write("identical content")
+        with record_test_evidence("individual.txt", "w") as f:
+            f.write(f"content {index}")
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_evidence_deduplication = {policy}
+    """)
+    _, root_node = run_and_parse(pytester, None)
+    items = root_node.findall(".//item[@name='reference.txt']")
+    assert len(items) == 3
+    for item_ in items:
+        assert base64.b64decode(item_.text) == b"identical content"
+        assert "sha256" not in item_.attrib
+    items = root_node.findall(".//item[@name='individual.txt']")
+    assert [base64.b64decode(item_.text) for item_ in items] == [
+        b"content 0", b"content 1", b"content 2"
+    ]
+
+
+def test_evidence_deduplication_once(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import record_test_evidence
+
+    @pytest.mark.parametrize("index", range(3))
+    def test_record_test_evidence(record_test_evidence, index):
+        with record_test_evidence("reference.txt", "w") as f:
+            f.write("identical content")
+
+    def test_record_encoded_evidence(record_property):
+        record_property(
+            "test_evidence",
+            {"filename": "reference.txt",
+             "content": "aWRlbnRpY2FsIGNvbnRlbnQ="}
+        )
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_evidence_deduplication = once
+    """)
+    _, root_node = run_and_parse(pytester, None)
+    first_item, *other_items = root_node.findall(
+        ".//item[@name='reference.txt']"
+    )
+    expected_digest = hashlib.sha256(b"identical content").hexdigest()
+    assert base64.b64decode(first_item.text) == b"identical content"
+    assert first_item.attrib["sha256"] == expected_digest
+    assert len(other_items) == 3
+    for item_ in other_items:
+        assert not item_.text
+        assert item_.attrib["sha256"] == expected_digest
+
+
+def test_all_properties(pytester: Pytester):
+    pytester.makepyfile("""
+    from pytest_junit_xray_xml import (
+        record_test_description,
+        record_test_id,
+        record_test_key,
+        record_test_summary
+    )
+
+    def test_record_all(record_test_description, record_test_id,
+                        record_test_key, record_test_summary, record_property):
+        record_test_description("line 1")
+        record_property("unrelated", "value")
+        record_test_key("JIRA-1234")
+        record_test_id("1234")
+        record_test_summary("My summary")
+        record_test_description("line 2")
+    """)
+    _, root_node = run_and_parse(pytester, None)
+    properties_node = root_node.find("./testcase/properties")
+    assert [
+        property_.attrib["name"] for property_ in properties_node
+    ] == ["test_description", "test_summary", "test_key", "test_id"]
+    assert properties_node[0].text == "line 1\nline 2"
+
+
+def test_multiple_ids(pytester: Pytester):
+    pytester.makepyfile("""
+    from pytest_junit_xray_xml import record_test_id
+
+    def test_record_id(record_test_id):
+        record_test_id("1")
+        record_test_id("2")
+    """)
+    result, _ = run_and_parse(pytester, None)
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(
+        "* pytest_junit_xray_xml.exceptions.MoreThanOneItemError: Found a "
+        "'test_id' already*"
+    )
+
+
+def test_shards_by_number_of_tests(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+
+    @pytest.mark.parametrize("index", range(5))
+    def test_shard(index):
+        assert index != 3
+    """)
+    xml_path = pytester.path / "xray.xml"
+    result = pytester.runpytest(
+        f"--junitxrayxml={xml_path}", "--junit-xray-xml-max-tests=2"
+    )
+    result.assert_outcomes(passed=4, failed=1)
+    assert not xml_path.exists()
+    index = json.loads(
+        (pytester.path / "xray.index.json").read_text(encoding="UTF-8")
+    )
+    assert index["tests"] == 5
+    assert index["failures"] == 1
+    assert [shard_["file"] for shard_ in index["shards"]] == [
+        "xray.001.xml", "xray.002.xml", "xray.003.xml"
+    ]
+    names = []
+    for shard_ in index["shards"]:
+        root_node = ET.parse(str(pytester.path / shard_["file"])).getroot()
+        assert root_node.attrib["tests"] == f"{shard_['tests']}"
+        assert root_node.attrib["failures"] == f"{shard_['failures']}"
+        names.extend(node_.attrib["name"] for node_ in root_node)
+    assert [shard_["tests"] for shard_ in index["shards"]] == [2, 2, 1]
+    assert [shard_["failures"] for shard_ in index["shards"]] == [0, 1, 0]
+    assert names == [f"test_shard[{index_}]" for index_ in range(5)]
+
+
+def test_shards_by_size(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import record_test_evidence
+
+    @pytest.mark.parametrize("index", range(4))
+    def test_shard(record_test_evidence, index):
+        with record_test_evidence("large.bin", "wb") as f:
+            f.write(bytes(3000))
+    """)
+    xml_path = pytester.path / "xray.xml"
+    pytester.runpytest(
+        f"--junitxrayxml={xml_path}", "--junit-xray-xml-max-bytes=5000"
+    )
+    index = json.loads(
+        (pytester.path / "xray.index.json").read_text(encoding="UTF-8")
+    )
+    assert [shard_["tests"] for shard_ in index["shards"]] == [2, 2]
+
+
+@pytest.mark.parametrize("streaming", ["false", "true"])
+def test_writer_thread(pytester: Pytester, streaming: str):
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import record_test_evidence
+
+    @pytest.mark.parametrize("index", range(20))
+    def test_record_test_evidence(record_test_evidence, index):
+        with record_test_evidence("file.txt", "w") as f:
+            f.write(f"content {index}")
+        assert index % 5
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_streaming = {streaming}
+    junit_xray_writer_thread = true
+    junit_xray_writer_queue_size = 2
+    """)
+    _, root_node = run_and_parse(pytester, None)
+    assert root_node.attrib["tests"] == "20"
+    assert root_node.attrib["failures"] == "4"
+    assert [
+        base64.b64decode(item_.text) for item_ in root_node.iter("item")
+    ] == [f"content {index_}".encode() for index_ in range(20)]
+
+
+def test_writer_thread_error(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+
+    @pytest.mark.parametrize("index", range(6))
+    def test_evidence(record_property, index):
+        # not base64, cannot be written
+        content = "\\u00e9" if index == 1 else "ZXZpZGVuY2U="
+        record_property(
+            "test_evidence", {"filename": "evidence.txt", "content": content}
+        )
+        assert index != 4
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_streaming = true
+    junit_xray_writer_thread = true
+    """)
+    result, root_node = run_and_parse(pytester, None)
+    result.assert_outcomes(passed=5, failed=1)
+    result.stdout.fnmatch_lines([
+        "*ReportWarning: Writing the report in the background failed*"
+        "UnicodeEncodeError*",
+    ])
+    assert result.stdout.str().count("ReportWarning: ") == 1
+    assert [node_.attrib["name"] for node_ in root_node] == [
+        f"test_evidence[{index_}]" for index_ in (0, 2, 3, 4, 5)
+    ]
+    assert root_node.attrib["tests"] == "5"
+    assert root_node.attrib["failures"] == "1"
+    assert sorted(path_.name for path_ in pytester.path.glob("xray*")) == [
+        "xray.xml"
+    ]
+
+
+def test_writer_thread_streams(pytester: Pytester):
+    pytester.makepyfile("""
+    import os
+    import time
+
+    def test_first():
+        pass
+
+    def test_second():
+        # the first testcase is written in the background, not at the end
+        deadline = time.monotonic() + 5
+        while not os.path.exists("xray.xml.part"):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_writer_thread = true
+    """)
+    result, root_node = run_and_parse(pytester, None)
+    result.assert_outcomes(passed=2)
+    assert len(root_node.findall("./testcase")) == 2
+    assert not list(pytester.path.glob("*.part"))
+
+
+@pytest.mark.parametrize("serializer", ["direct", "etree", "lxml"])
+def test_serializer(pytester: Pytester, serializer: str):
+    if serializer == "lxml":
+        pytest.importorskip("lxml")
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import (
+        record_test_description,
+        record_test_evidence,
+        record_test_summary
+    )
+
+    def test_special_characters(record_test_description, record_test_evidence,
+                                record_test_summary):
+        record_test_description('<a href="x">&amp;</a>\\ttab')
+        record_test_summary('"quoted" & <tagged>')
+        with record_test_evidence("file.txt", "w") as f:
+            f.write("evidence")
+
+    def test_fail():
+        assert "<" == "&"
+
+    def test_skip():
+        pytest.skip("<skipped> & \\"quoted\\"")
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_serializer = {serializer}
+    """)
+    _, root_node = run_and_parse(pytester, None)
+    properties_node = root_node.find(
+        "./testcase[@name='test_special_characters']/properties"
+    )
+    assert properties_node.find("./property[@name='test_description']").text \
+        == '<a href="x">&amp;</a>\ttab'
+    assert properties_node.find(
+        "./property[@name='test_summary']"
+    ).attrib["value"] == '"quoted" & <tagged>'
+    assert base64.b64decode(properties_node.find(".//item").text) \
+        == b"evidence"
+    failure_node = root_node.find("./testcase[@name='test_fail']/failure")
+    assert "assert '<' == '&'" in failure_node.text
+    skipped_node = root_node.find("./testcase[@name='test_skip']/skipped")
+    assert "Skipped: <skipped> & \"quoted\"" in skipped_node.attrib["message"]
+
+
+def test_serializer_unknown(pytester: Pytester):
+    pytester.makepyfile("""
+    def test_pass():
+        pass
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_serializer = unknown
+    """)
+    result = pytester.runpytest(f"--junitxrayxml={pytester.path / 'x.xml'}")
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines(["*Unknown serializer 'unknown'*"])
+
+
+@pytest.mark.parametrize("serializer", ["direct", "etree"])
+@pytest.mark.parametrize("streaming", ["false", "true"])
+def test_compact(pytester: Pytester, serializer: str, streaming: str):
+    pytester.makepyfile("""
+    from pytest_junit_xray_xml import (
+        record_test_description,
+        record_test_evidence
+    )
+
+    def test_evidence(record_test_description, record_test_evidence):
+        record_test_description("line 1\\nline 2")
+        with record_test_evidence("file.txt", "w") as f:
+            f.write("evidence")
+
+    def test_fail():
+        assert False
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_serializer = {serializer}
+    junit_xray_streaming = {streaming}
+    """)
+    indented_path = pytester.path / "indented.xml"
+    compact_path = pytester.path / "compact.xml"
+    pytester.runpytest(f"--junitxrayxml={indented_path}")
+    pytester.runpytest(
+        f"--junitxrayxml={compact_path}", "--junit-xray-xml-compact"
+    )
+    declaration, compact_report = compact_path.read_text().split("\n", 1)
+    assert declaration.startswith("<?xml")
+    assert compact_report.startswith("<test_suite ")
+    assert ">\n" not in compact_report and ">    <" not in compact_report
+    indented_root = ET.parse(indented_path).getroot()
+    compact_root = ET.parse(compact_path).getroot()
+    for element_ in indented_root.iter():
+        if element_.text is not None and not element_.text.strip():
+            element_.text = None
+        element_.tail = None
+    for indented_, compact_ in zip(indented_root.iter(), compact_root.iter()):
+        assert indented_.tag == compact_.tag
+        assert indented_.text == compact_.text
+        if indented_.tag not in ("test_suite", "testcase"):
+            assert indented_.attrib == compact_.attrib
+    assert len(list(indented_root.iter())) == len(list(compact_root.iter()))
+
+
+@pytest.mark.parametrize("streaming", ["false", "true"])
+def test_compression_gzip(pytester: Pytester, streaming: str):
+    pytester.makepyfile("""
+    from pytest_junit_xray_xml import record_test_evidence
+
+    def test_evidence(record_test_evidence):
+        with record_test_evidence("file.txt", "w") as f:
+            f.write("evidence")
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_streaming = {streaming}
+    junit_xray_compression_level = 1
+    """)
+    xml_path = pytester.path / "xray.xml.gz"
+    pytester.runpytest(f"--junitxrayxml={xml_path}")
+    with gzip.open(xml_path, "rb") as xml_file:
+        root_node = ET.parse(xml_file).getroot()
+    assert root_node.attrib["tests"] == "1"
+    assert base64.b64decode(root_node.find(".//item").text) == b"evidence"
+    assert not list(pytester.path.glob("*.part"))
+    if streaming == "true":
+        # the compressed body between the members of the start and end tag
+        import zlib
+
+        data = xml_path.read_bytes()
+        number_of_members = 0
+        while data:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            decompressor.decompress(data)
+            data = decompressor.unused_data
+            number_of_members += 1
+        assert number_of_members == 3
+
+
+def test_compression_shards(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+
+    @pytest.mark.parametrize("index", range(3))
+    def test_shard(index):
+        pass
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_compression = gzip
+    """)
+    xml_path = pytester.path / "xray.xml"
+    pytester.runpytest(
+        f"--junitxrayxml={xml_path}", "--junit-xray-xml-max-tests=2"
+    )
+    index = json.loads(
+        (pytester.path / "xray.index.json").read_text(encoding="UTF-8")
+    )
+    assert [shard_["file"] for shard_ in index["shards"]] == [
+        "xray.001.xml", "xray.002.xml"
+    ]
+    names = []
+    for shard_ in index["shards"]:
+        with gzip.open(pytester.path / shard_["file"], "rb") as shard_file:
+            names.extend(
+                node_.attrib["name"]
+                for node_ in ET.parse(shard_file).getroot()
+            )
+    assert names == [f"test_shard[{index_}]" for index_ in range(3)]
+
+
+@pytest.mark.parametrize("streaming", ["false", "true"])
+def test_compression_zstd(pytester: Pytester, streaming: str):
+    zstandard = pytest.importorskip("zstandard")
+    pytester.makepyfile("""
+    def test_pass():
+        pass
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_streaming = {streaming}
+    """)
+    xml_path = pytester.path / "xray.xml.zst"
+    pytester.runpytest(f"--junitxrayxml={xml_path}")
+    with open(xml_path, "rb") as xml_file:
+        # streamed reports consist of several frames
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            xml_file, read_across_frames=True
+        )
+        root_node = ET.fromstring(reader.read())
+    assert root_node.attrib["tests"] == "1"
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_fragment_writer_removes_failed_testcase(tmp_path, compression: str):
+    from pytest_junit_xray_xml.compressors import open_input
+    from pytest_junit_xray_xml.evidence import BaseEvidence
+    from pytest_junit_xray_xml.records import ResultRecord
+    from pytest_junit_xray_xml.writers import FragmentWriter, write_report
+
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+
+    class BrokenEvidence(BaseEvidence):
+        filename = "broken.bin"
+
+        def iter_chunks(self, chunk_size: int = 3):
+            yield b"abc"
+            raise OSError("The evidence is gone")
+
+    body_file_name = str(tmp_path / "body.part")
+    writer = FragmentWriter(body_file_name, compression=compression)
+    writer.add_testcase(ResultRecord("test_first", None, None, 0.1), "passed")
+    broken_record = ResultRecord("test_broken", None, None, 0.1)
+    broken_record.add_property(
+        "testrun_evidence", items=[("broken.bin", BrokenEvidence(), None)]
+    )
+    with pytest.raises(OSError):
+        writer.add_testcase(broken_record, "passed")
+    writer.add_testcase(ResultRecord("test_last", None, None, 0.1), "passed")
+    writer.close()
+    xml_path = str(tmp_path / "xray.xml")
+    write_report(xml_path, {"tests": "2"}, [body_file_name],
+                 compression=compression)
+    with open_input(xml_path) as xml_file:
+        root_node = ET.fromstring(xml_file.read())
+    assert [node_.attrib["name"] for node_ in root_node] == [
+        "test_first", "test_last"
+    ]
+
+
+def test_merge(pytester: Pytester):
+    from pytest_junit_xray_xml.merge import main
+
+    pytester.makepyfile(test_first="""
+    from pytest_junit_xray_xml import record_test_evidence, record_test_key
+
+    def test_evidence(record_test_evidence, record_test_key):
+        record_test_key("JIRA-1")
+        with record_test_evidence("file.txt", "w") as f:
+            f.write("evidence")
+
+    def test_fail():
+        assert False
+    """, test_second="""
+    import pytest
+
+    @pytest.mark.parametrize("index", range(3))
+    def test_skip(index):
+        pytest.skip("skipped")
+    """)
+    first_path = pytester.path / "first.xml.gz"
+    second_path = pytester.path / "second.xml"
+    pytester.runpytest("test_first.py", f"--junitxrayxml={first_path}")
+    pytester.runpytest(
+        "test_second.py", f"--junitxrayxml={second_path}",
+        "--junit-xray-xml-max-tests=2"
+    )
+    merged_path = pytester.path / "merged.xml"
+    main([
+        str(first_path),
+        str(pytester.path / "second.index.json"),
+        "--output",
+        str(merged_path)
+    ])
+    root_node = ET.parse(merged_path).getroot()
+    assert root_node.attrib["tests"] == "5"
+    assert root_node.attrib["failures"] == "1"
+    assert root_node.attrib["skipped"] == "3"
+    assert root_node.attrib["errors"] == "0"
+    assert [node_.attrib["name"] for node_ in root_node] == [
+        "test_evidence", "test_fail",
+        "test_skip[0]", "test_skip[1]", "test_skip[2]"
+    ]
+    item_node = root_node.find(".//item")
+    assert base64.b64decode(item_node.text) == b"evidence"
+    with gzip.open(first_path, "rb") as first_file:
+        first_report = first_file.read().decode("UTF-8")
+    first_testcases = first_report.split("\n", 2)[2].rsplit("\n", 1)[0]
+    assert first_testcases in merged_path.read_text(encoding="UTF-8")
+
+
+@pytest.mark.parametrize("streaming", ["false", "true"])
+def test_update(pytester: Pytester, streaming: str):
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_streaming = {streaming}
+    """)
+    pytester.makepyfile("""
+    import pytest
+
+    @pytest.mark.parametrize("index", range(4))
+    def test_flaky(index):
+        assert index not in (1, 2)
+    """)
+    xml_path = pytester.path / "xray.xml.gz"
+    result = pytester.runpytest(f"--junitxrayxml={xml_path}")
+    result.assert_outcomes(passed=2, failed=2)
+    pytester.makepyfile("""
+    import pytest
+
+    @pytest.mark.parametrize("index", range(4))
+    def test_flaky(index):
+        assert index != 2
+
+    def test_new():
+        pass
+    """)
+    result = pytester.runpytest(
+        f"--junitxrayxml={xml_path}", "--junit-xray-xml-update", "--lf"
+    )
+    result.assert_outcomes(passed=1, failed=1)
+    with gzip.open(xml_path, "rb") as xml_file:
+        root_node = ET.parse(xml_file).getroot()
+    assert [node_.attrib["name"] for node_ in root_node] == [
+        f"test_flaky[{index_}]" for index_ in range(4)
+    ]
+    assert [node_.find("failure") is not None for node_ in root_node] == [
+        False, False, True, False
+    ]
+    assert root_node.attrib["tests"] == "4"
+    assert root_node.attrib["failures"] == "1"
+    assert sorted(path_.name for path_ in pytester.path.glob("xray*")) == [
+        "xray.xml.gz"
+    ]
+
+
+@pytest.mark.parametrize("arguments, message", [
+    (["x.xml", "--junit-xray-xml-update", "--junit-xray-xml-max-tests=2"],
+     "*Sharded reports cannot be updated*"),
+    (["x.json", "--junit-xray-xml-max-tests=2"],
+     "*Xray JSON format cannot be updated or sharded*"),
+    (["x.xml", "--junit-xray-xml-max-tests=2", "-o",
+      "junit_xray_evidence_deduplication=once"],
+     "*Sharded reports require junit_xray_evidence_deduplication no or*"),
+    (["x.json", "-o", "junit_xray_evidence_deduplication=once"],
+     "*Xray JSON format require junit_xray_evidence_deduplication no or*"),
+    (["x.xml", "--junit-xray-xml-update", "-o", "junit_family=xunit2"],
+     "*Reports of junit_family xunit2 cannot be updated*"),
+    (["x.xml", "-o", "junit_xray_slowest=abc"],
+     "*invalid literal for int()*'abc'*"),
+])
+def test_invalid_option_combinations(pytester: Pytester, arguments: list,
+                                     message: str):
+    pytester.makepyfile("""
+    def test_pass():
+        pass
+    """)
+    xml_name, *options = arguments
+    result = pytester.runpytest(
+        f"--junitxrayxml={pytester.path / xml_name}", *options
+    )
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines([message])
+    result.stdout.no_fnmatch_line("*INTERNALERROR*")
+
+
+def test_xdist_sharded(pytester: Pytester):
+    pytest.importorskip("xdist")
+    pytester.makepyfile("""
+    def test_pass():
+        pass
+    """)
+    result = pytester.runpytest(
+        f"--junitxrayxml={pytester.path / 'x.xml'}", "-n", "2",
+        "--junit-xray-xml-max-tests=2"
+    )
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines([
+        "*Sharded reports are not supported together with pytest-xdist*"
+    ])
+
+
+def test_update_failure_and_teardown_error(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+
+    @pytest.fixture
+    def broken_teardown():
+        yield
+        raise ValueError("teardown")
+
+    def test_x(broken_teardown):
+        assert False
+
+    def test_y():
+        pass
+    """)
+    xml_path = pytester.path / "xray.xml"
+    result = pytester.runpytest(f"--junitxrayxml={xml_path}")
+    result.assert_outcomes(passed=1, failed=1, errors=1)
+    root_node = ET.parse(xml_path).getroot()
+    assert [node_.attrib["name"] for node_ in root_node] == [
+        "test_x", "test_x", "test_y"
+    ]
+    pytester.makepyfile("""
+    def test_x():
+        pass
+
+    def test_y():
+        pass
+    """)
+    result = pytester.runpytest(
+        f"--junitxrayxml={xml_path}", "--junit-xray-xml-update", "-k", "test_x"
+    )
+    result.assert_outcomes(passed=1)
+    root_node = ET.parse(xml_path).getroot()
+    assert [node_.attrib["name"] for node_ in root_node] == [
+        "test_x", "test_y"
+    ]
+    assert root_node.find(".//failure") is None
+    assert root_node.find(".//error") is None
+    assert root_node.attrib["tests"] == "2"
+    assert root_node.attrib["failures"] == "0"
+    assert root_node.attrib["errors"] == "0"
+
+
+@pytest.mark.parametrize("serializer", ["direct", "etree"])
+def test_update_keeps_suite_properties(pytester: Pytester, serializer: str):
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_slowest = 2
+    junit_xray_serializer = {serializer}
+    """)
+    pytester.makepyfile("""
+    def test_x():
+        pass
+
+    def test_y():
+        pass
+    """)
+    xml_path = pytester.path / "xray.xml"
+    pytester.runpytest(f"--junitxrayxml={xml_path}")
+    result = pytester.runpytest(
+        f"--junitxrayxml={xml_path}", "--junit-xray-xml-update", "-k", "test_x"
+    )
+    result.assert_outcomes(passed=1)
+    root_node = ET.parse(xml_path).getroot()
+    assert [node_.tag for node_ in root_node] == [
+        "properties", "testcase", "testcase"
+    ]
+    # the slowest tests of the session which updated the report
+    slowest_tests = root_node.findall(
+        "./properties/property[@name='slowest_tests']/item"
+    )
+    assert [node_.attrib["name"] for node_ in slowest_tests] == [
+        "test_update_keeps_suite_properties.py::test_x"
+    ]
+
+
+@pytest.mark.parametrize("xdist", [False, True])
+def test_profile(pytester: Pytester, xdist: bool):
+    if xdist:
+        pytest.importorskip("xdist")
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import record_test_evidence
+
+    @pytest.mark.parametrize("index", range(4))
+    def test_evidence(record_test_evidence, index):
+        with record_test_evidence("file.txt", "w") as f:
+            f.write("evidence")
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_profile_file = profile.json
+    """)
+    xml_path = pytester.path / "xray.xml"
+    arguments = ["-n", "2"] if xdist else []
+    result = pytester.runpytest(f"--junitxrayxml={xml_path}", *arguments)
+    result.stdout.fnmatch_lines([
+        "*junit-xray-xml profile*",
+        "logreport *s * calls",
+    ])
+    profile = json.loads(
+        (pytester.path / "profile.json").read_text(encoding="UTF-8")
+    )
+    timings = profile["timings"]
+    assert timings["logreport"]["calls"] == 12
+    assert timings["process_test_evidences"]["calls"] == 4
+    assert timings["encode_evidence"]["calls"] == 4
+    assert profile["bytes_written"] >= xml_path.stat().st_size
+    assert profile["peak_memory"] > 0
+
+
+@pytest.mark.parametrize("xdist", [False, True])
+def test_phase_durations_and_slowest(pytester: Pytester, xdist: bool):
+    if xdist:
+        pytest.importorskip("xdist")
+    pytester.makepyfile("""
+    import time
+
+    import pytest
+
+    @pytest.fixture
+    def slow_fixture():
+        time.sleep(0.2)
+        yield
+        time.sleep(0.1)
+
+    def test_slow(slow_fixture):
+        pass
+
+    @pytest.mark.parametrize("index", range(3))
+    def test_fast(index):
+        pass
+
+    def test_fail(slow_fixture):
+        assert False
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_phase_durations = true
+    junit_xray_slowest = 2
+    """)
+    xml_path = pytester.path / "xray.xml"
+    arguments = ["-n", "2"] if xdist else []
+    pytester.runpytest(f"--junitxrayxml={xml_path}", *arguments)
+    root_node = ET.parse(xml_path).getroot()
+    properties = {
+        node_.attrib["name"]: float(node_.attrib["value"])
+        for node_ in root_node.findall(
+            "./testcase[@name='test_slow']/properties/property"
+        )
+    }
+    assert properties["setup_duration"] >= 0.2
+    assert properties["teardown_duration"] >= 0.1
+    assert "call_duration" in properties
+    assert root_node.find(
+        "./testcase[@name='test_fail']/properties/"
+        "property[@name='teardown_duration']"
+    ) is not None
+    assert [node_.tag for node_ in root_node][0] == "properties"
+    assert len(root_node.findall("testcase")) == 5
+    slowest_tests = root_node.findall(
+        "./properties/property[@name='slowest_tests']/item"
+    )
+    assert sorted(node_.attrib["name"] for node_ in slowest_tests) == [
+        "test_phase_durations_and_slowest.py::test_fail",
+        "test_phase_durations_and_slowest.py::test_slow",
+    ]
+    assert float(slowest_tests[0].attrib["duration"]) >= 0.3
+    slowest_fixtures = root_node.findall(
+        "./properties/property[@name='slowest_fixtures']/item"
+    )
+    assert slowest_fixtures[0].attrib["name"] == "slow_fixture"
+    assert slowest_fixtures[0].attrib["count"] == "2"
+    assert float(slowest_fixtures[0].attrib["duration"]) >= 0.4
+
+
+@pytest.mark.parametrize("serializer", ["direct", "etree"])
+def test_captured_output(pytester: Pytester, serializer: str):
+    pytester.makepyfile("""
+    import logging
+    import sys
+
+    def test_output():
+        print("head <&>" + "x" * 1000 + "tail <&>")
+        sys.stderr.write("error output")
+        logging.getLogger().warning("logged")
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_logging = all
+    junit_xray_serializer = {serializer}
+    junit_xray_output_spool_size = 100
+    """)
+    _, root_node = run_and_parse(pytester, None)
+    system_out = root_node.find("./testcase/system-out").text
+    assert "head <&>" + "x" * 1000 + "tail <&>" in system_out
+    assert " Captured Log " in system_out and "logged" in system_out
+    assert " Captured Out " in system_out
+    assert "error output" in root_node.find("./testcase/system-err").text
+
+
+def test_captured_output_limits(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+
+    @pytest.mark.parametrize("index", range(3))
+    def test_output(index):
+        print("head" + "x" * 10000 + "tail")
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_logging = system-out
+    junit_xray_output_limit = 1000
+    junit_xray_output_run_limit = 1500
+    junit_xray_output_spool_size = 100
+    """)
+    _, root_node = run_and_parse(pytester, None)
+    system_outs = [
+        node_.text or "" for node_ in root_node.findall("./testcase/system-out")
+    ]
+    assert "head" in system_outs[0] and "tail" in system_outs[0]
+    assert "characters truncated" in system_outs[0]
+    assert len(system_outs[0]) < 1100
+    assert "head" in system_outs[1] and "tail" in system_outs[1]
+    assert len(system_outs[1]) < 600
+    assert "head" not in system_outs[2]
+    assert "characters truncated" in system_outs[2]
+
+
+def test_concurrent_reports(tmp_path):
+    import threading
+
+    from _pytest.reports import TestReport
+
+    from pytest_junit_xray_xml.junit_xml_xray_xml import LogJunitXrayXml
+
+    log = LogJunitXrayXml(
+        str(tmp_path / "xray.xml"), family="xray", phase_durations=True
+    )
+    log.pytest_sessionstart()
+    barrier = threading.Barrier(8)
+
+    def run_test(index: int) -> None:
+        for when_ in ("setup", "call", "teardown"):
+            # all threads report the same phase at the same time
+            barrier.wait()
+            log.pytest_runtest_logreport(TestReport(
+                nodeid=f"tests/test_{index}.py::test_{index}",
+                location=(f"tests/test_{index}.py", index, f"test_{index}"),
+                keywords={},
+                outcome="passed",
+                longrepr=None,
+                when=when_,
+                duration=index,
+                user_properties=(
+                    [("test_key", f"JIRA-{index}")] if when_ == "call" else []
+                ),
+            ))
+
+    threads = [
+        threading.Thread(target=run_test, args=(index_,))
+        for index_ in range(8)
+    ]
+    for thread_ in threads:
+        thread_.start()
+    for thread_ in threads:
+        thread_.join()
+    log.pytest_sessionfinish()
+    root_node = ET.parse(tmp_path / "xray.xml").getroot()
+    assert root_node.attrib["tests"] == "8"
+    testcases = sorted(root_node, key=lambda node_: int(node_.attrib["line"]))
+    for index_, testcase_ in enumerate(testcases):
+        assert testcase_.attrib["name"] == f"test_{index_}"
+        assert testcase_.attrib["file"] == f"tests/test_{index_}.py"
+        assert testcase_.find(
+            "./properties/property[@name='test_key']"
+        ).attrib["value"] == f"JIRA-{index_}"
+        assert testcase_.find(
+            "./properties/property[@name='setup_duration']"
+        ).attrib["value"] == f"{float(index_)}"
+
+
+def test_xray_marker_and_key_map(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import record_test_key
+
+    @pytest.mark.xray("JIRA-1", summary="marked")
+    def test_marker():
+        pass
+
+    @pytest.mark.xray(key="JIRA-2")
+    def test_marker_and_fixture(record_test_key):
+        record_test_key("JIRA-3")
+
+    @pytest.mark.parametrize("index", range(2))
+    def test_key_map(index):
+        pass
+
+    @pytest.mark.xray(summary="marker wins")
+    def test_key_map_and_marker():
+        pass
+    """)
+    pytester.makefile(".json", key_map=json.dumps({
+        "test_xray_marker_and_key_map.py::test_key_map": "JIRA-4",
+        "test_xray_marker_and_key_map.py::test_key_map[1]": {
+            "key": "JIRA-5", "description": "only the second"
+        },
+        "test_xray_marker_and_key_map.py::test_key_map_and_marker": {
+            "key": "JIRA-6", "summary": "key map"
+        },
+    }))
+    pytester.makeini("""
+    [pytest]
+    junit_xray_key_map = key_map.json
+    """)
+    xml_path = pytester.path / "xray.xml"
+    result = pytester.runpytest(
+        f"--junitxrayxml={xml_path}", "--strict-markers"
+    )
+    result.assert_outcomes(passed=5)
+    root_node = ET.parse(xml_path).getroot()
+
+    def get_properties(name: str) -> dict:
+        result = {
+            node_.attrib["name"]: node_.attrib.get("value", node_.text)
+            for node_ in root_node.findall(
+                f"./testcase[@name='{name}']/properties/property"
+            )
+        }
+        return result
+
+    assert get_properties("test_marker") == {
+        "test_key": "JIRA-1", "test_summary": "marked"
+    }
+    assert get_properties("test_marker_and_fixture") == {"test_key": "JIRA-3"}
+    assert get_properties("test_key_map[0]") == {"test_key": "JIRA-4"}
+    assert get_properties("test_key_map[1]") == {
+        "test_key": "JIRA-5", "test_description": "only the second"
+    }
+    assert get_properties("test_key_map_and_marker") == {
+        "test_key": "JIRA-6", "test_summary": "marker wins"
+    }
+
+
+def test_xray_marker_unknown_argument(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+
+    @pytest.mark.xray(keys="JIRA-1")
+    def test_marker():
+        pass
+    """)
+    result = pytester.runpytest(f"--junitxrayxml={pytester.path / 'x.xml'}")
+    result.stderr.fnmatch_lines([
+        "*Unknown Xray metadata *keys* in the marker*"
+    ])
+
+
+def test_xray_marker_without_report(pytester: Pytester):
+    pytester.makepyfile("""
+    import pytest
+
+    @pytest.mark.xray("JIRA-1")
+    def test_marker():
+        pass
+    """)
+    result = pytester.runpytest("--strict-markers")
+    result.assert_outcomes(passed=1)
+
+
+@pytest.mark.parametrize("compact", ["false", "true"])
+def test_xray_json(pytester: Pytester, compact: str):
+    pytester.makepyfile("""
+    import pytest
+    from pytest_junit_xray_xml import (
+        record_test_description,
+        record_test_evidence,
+        record_test_key,
+        record_test_summary
+    )
+
+    def test_key(record_test_key, record_test_evidence):
+        record_test_key("JIRA-1")
+        with record_test_evidence("file.txt", "w") as f:
+            f.write("evidence")
+        with record_test_evidence("image.png", "wb") as f:
+            f.write(b"\\x89PNG")
+
+    def test_info(record_test_summary, record_test_description):
+        record_test_summary("summary \\"quoted\\"")
+        record_test_description("description")
+        assert False
+
+    def test_skip():
+        pytest.skip("skipped")
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_compact = {compact}
+    """)
+    json_path = pytester.path / "xray.json"
+    pytester.runpytest(f"--junitxrayxml={json_path}")
+    report = json.loads(json_path.read_text(encoding="UTF-8"))
+    assert "failures" in report["info"]["summary"]
+    assert report["info"]["startDate"] <= report["info"]["finishDate"]
+    key_test, info_test, skip_test = report["tests"]
+    assert key_test["testKey"] == "JIRA-1"
+    assert key_test["status"] == "PASSED"
+    assert [
+        (evidence_["filename"], evidence_.get("contentType"),
+         base64.b64decode(evidence_["data"]))
+        for evidence_ in key_test["evidence"]
+    ] == [
+        ("file.txt", "text/plain", b"evidence"),
+        ("image.png", "image/png", b"\x89PNG"),
+    ]
+    assert info_test["testInfo"] == {
+        "summary": "summary \"quoted\"",
+        "type": "Generic",
+        "definition": "description",
+    }
+    assert info_test["status"] == "FAILED"
+    assert "assert False" in info_test["comment"]
+    assert skip_test["status"] == "TODO"
+    assert skip_test["testInfo"]["summary"] == "test_skip"
+
+
+def test_xray_json_project_key(pytester: Pytester):
+    pytester.makepyfile("""
+    def test_info():
+        pass
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_project_key = JIRA
+    """)
+    json_path = pytester.path / "xray.json"
+    pytester.runpytest(f"--junitxrayxml={json_path}")
+    report = json.loads(json_path.read_text(encoding="UTF-8"))
+    assert report["info"]["project"] == "JIRA"
+    assert report["tests"][0]["testInfo"] == {
+        "summary": "test_info",
+        "type": "Generic",
+        "projectKey": "JIRA",
+    }
+
+
+def test_xray_json_empty(pytester: Pytester):
+    pytester.makepyfile("""
+    def test_nothing():
+        pass
+    """)
+    json_path = pytester.path / "xray.json.gz"
+    pytester.runpytest(f"--junitxrayxml={json_path}", "-k", "unknown")
+    with gzip.open(json_path, "rb") as json_file:
+        report = json.load(json_file)
+    assert report["tests"] == []
+
+
+def test_record_test_evidence_deferred(pytester: Pytester):
+    pytester.makepyfile("""
+    import concurrent.futures
+
+    from pytest_junit_xray_xml import record_test_evidence
+
+    def test_record_test_evidence(record_test_evidence):
+        record_test_evidence("callable.txt", lambda: "from a callable")
+        future = concurrent.futures.Future()
+        future.set_result(b"from a future")
+        evidence = record_test_evidence("future.txt", future)
+        assert evidence.filename == "future.txt"
+    """)
+    result, xml = run_and_parse(pytester, None)
+    result.assert_outcomes(passed=1)
+    items = xml.findall(".//property[@name='testrun_evidence']/item")
+    assert [item_.get("name") for item_ in items] == [
+        "callable.txt", "future.txt"
+    ]
+    assert [base64.b64decode(item_.text) for item_ in items] == [
+        b"from a callable", b"from a future"
+    ]
+
+
+@pytest.mark.parametrize("producer, message", [
+    ("fail", "Producing the test evidence 'slow.txt' failed: "
+             "ValueError('broken producer')"),
+    ("sleep", "Producing the test evidence 'slow.txt' took longer than "
+              "0.05 s"),
+])
+@pytest.mark.parametrize("streaming", ["false", "true"])
+def test_record_test_evidence_deferred_error(pytester: Pytester,
+                                             producer: str, message: str,
+                                             streaming: str):
+    pytester.makepyfile("""
+    import time
+
+    from pytest_junit_xray_xml import record_test_evidence
+
+    def fail():
+        raise ValueError("broken producer")
+
+    def sleep():
+        time.sleep(1)
+        return b"too late"
+
+    def test_first(record_test_evidence):
+        record_test_evidence("first.txt", lambda: b"first")
+
+    def test_record_test_evidence(record_test_evidence):
+        record_test_evidence("slow.txt", %s)
+
+    def test_last():
+        assert False
+    """ % producer)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_evidence_timeout = 0.05
+    junit_xray_streaming = {streaming}
+    """)
+    result, root_node = run_and_parse(pytester, None)
+    result.assert_outcomes(passed=2, failed=1)
+    result.stdout.fnmatch_lines([f"*EvidenceWarning: *{message}*"])
+    assert [node_.attrib["name"] for node_ in root_node] == [
+        "test_first", "test_record_test_evidence", "test_last"
+    ]
+    assert root_node.attrib["failures"] == "1"
+    assert root_node.find("./testcase[@name='test_last']/failure") \
+        is not None
+    first_item = root_node.find(".//item[@name='first.txt']")
+    assert base64.b64decode(first_item.text) == b"first"
+    testcase = root_node.find("./testcase[@name='test_record_test_evidence']")
+    assert not testcase.find(".//item[@name='slow.txt']").text
+    error_node = testcase.find(".//property[@name='testrun_evidence_error']")
+    assert error_node.attrib["value"] == "slow.txt"
+    assert error_node.text == message
+
+
+@pytest.mark.parametrize("streaming", ["false", "true"])
+def test_record_test_evidence_deferred_overlaps(pytester: Pytester,
+                                                streaming: str):
+    pytester.makepyfile("""
+    import threading
+
+    import pytest
+    from pytest_junit_xray_xml import record_test_evidence
+
+    later_test_started = threading.Event()
+
+    @pytest.fixture
+    def release():
+        yield
+        later_test_started.set()
+
+    def produce():
+        # only possible if the evidence is not waited for in the same test
+        assert later_test_started.wait(5)
+        return b"produced later"
+
+    def test_first(record_test_evidence, release):
+        record_test_evidence("later.txt", produce)
+
+    def test_second():
+        pass
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_evidence_timeout = 2
+    junit_xray_streaming = {streaming}
+    """)
+    result, root_node = run_and_parse(pytester, None)
+    result.assert_outcomes(passed=2)
+    item_node = root_node.find(".//item[@name='later.txt']")
+    assert base64.b64decode(item_node.text) == b"produced later"
+
+
+def test_record_test_evidence_deferred_does_not_block_exit(
+        pytester: Pytester):
+    pytester.makepyfile("""
+    import time
+
+    from pytest_junit_xray_xml import record_test_evidence
+
+    def test_record_test_evidence(record_test_evidence):
+        record_test_evidence("slow.txt", lambda: time.sleep(30))
+    """)
+    pytester.makeini("""
+    [pytest]
+    junit_xray_evidence_timeout = 0.1
+    """)
+    start_time = time.monotonic()
+    result = pytester.runpytest_subprocess(
+        f"--junitxrayxml={pytester.path / 'xray.xml'}"
+    )
+    assert time.monotonic() - start_time < 20
+    result.assert_outcomes(passed=1)
+
+
+@pytest.mark.parametrize("streaming", ["false", "true"])
+def test_encoding_workers(pytester: Pytester, streaming: str):
+    pytester.makepyfile("""
+    import pytest
+
+    from pytest_junit_xray_xml import record_test_evidence
+
+    @pytest.mark.parametrize("size", [10, 8 * 1024 * 1024])
+    def test_record_test_evidence(record_test_evidence, size):
+        with record_test_evidence("evidence.bin", "wb") as f:
+            f.write(bytes(range(256)) * (size // 256) + b"end")
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    junit_xray_streaming = {streaming}
+    junit_xray_encoding_workers = 2
+    junit_xray_encoding_window = 3
+    """)
+    result, root_node = run_and_parse(pytester, None)
+    result.assert_outcomes(passed=2)
+    items = root_node.findall(
+        "./testcase/properties/property[@name='testrun_evidence']/item"
+    )
+    assert [base64.b64decode(item_.text) for item_ in items] == [
+        bytes(range(256)) * (size_ // 256) + b"end"
+        for size_ in (10, 8 * 1024 * 1024)
+    ]
+
+
+@pytest.mark.parametrize("max_size", [1024 * 1024, 100])
+def test_parallel_encoder_keeps_order(max_size: int):
+    from pytest_junit_xray_xml.encoders import ParallelEncoder
+    from pytest_junit_xray_xml.evidence import SpooledEvidence
+
+    # in memory, or in a file which is read by the processes
+    evidence = SpooledEvidence("evidence.bin", max_size)
+    evidence.write(b"".join(bytes([index_]) * 300 for index_ in range(100)))
+    evidence.close()
+    assert (evidence.get_path() is None) == (max_size > 30000)
+    encoder = ParallelEncoder(2, window=2, chunk_size=3 * 100)
+    try:
+        actual = b"".join(encoder.iter_base64(evidence))
+    finally:
+        encoder.close()
+    assert actual == b"".join(evidence.iter_base64())
+
+
+def test_parallel_encoder_encodes_ahead():
+    from pytest_junit_xray_xml.encoders import ParallelEncoder
+    from pytest_junit_xray_xml.evidence import (
+        DeferredEvidence, SpooledEvidence
+    )
+
+    evidences = []
+    for size_ in (100, 1000, 10, 700):
+        evidence = SpooledEvidence(f"evidence_{size_}.bin")
+        evidence.write(bytes(range(256)) * (size_ // 256) + b"end")
+        evidence.close()
+        evidences.append(evidence)
+    empty_evidence = SpooledEvidence("empty.txt")
+    empty_evidence.close()
+    future = concurrent.futures.Future()
+    deferred_evidence = DeferredEvidence("deferred.txt", future)
+    encoder = ParallelEncoder(2, window=5, chunk_size=3 * 100)
+    try:
+        # the deferred evidence which is not produced yet is not waited for
+        for evidence_ in [deferred_evidence, *evidences]:
+            encoder.add(evidence_)
+        assert encoder._pending == 0
+        future.set_result("deferred")
+        # queued again, which goes on with the submission
+        encoder.add(evidences[0])
+        # all chunks across the evidence up to the window
+        assert encoder._pending == 5
+        # written out of order, or not queued at all
+        actual = [
+            b"".join(encoder.iter_base64(evidence_))
+            for evidence_ in [
+                deferred_evidence, *evidences[1:], evidences[0],
+                empty_evidence
+            ]
+        ]
+        assert encoder._pending == 0
+    finally:
+        encoder.close()
+    assert actual == [
+        b"".join(evidence_.iter_base64())
+        for evidence_ in [
+            deferred_evidence, *evidences[1:], evidences[0], empty_evidence
+        ]
+    ]
+
+
+def test_result_record_serialization():
+    from pytest_junit_xray_xml.captures import SpooledText
+    from pytest_junit_xray_xml.evidence import EncodedEvidence
+    from pytest_junit_xray_xml.records import ResultRecord
+    from pytest_junit_xray_xml.serializers import DirectSerializer
+
+    passed_record = ResultRecord("test_pass", "tests/test_a.py", 1, 0.5)
+    failed_record = ResultRecord(
+        "test_fail", None, None, 0.25, outcome="failure"
+    )
+    failed_record.text = "assert '<' == \"&\""
+    failed_record.system_out = "captured\n"
+    failed_record.system_err = ""
+    failed_record.add_property("test_key", value="JIRA-1")
+    failed_record.add_property("test_description", text="line 1\nline 2")
+    failed_record.add_property("testrun_evidence", items=[
+        ("a.txt", EncodedEvidence("a.txt", "YQ=="), None),
+        ("b.txt", None, "0123"),
+    ])
+    error_record = ResultRecord("test_error", "tests/test_a.py", 3, 0.0,
+                                outcome="error")
+    error_record.message = "error during setup: \"broken\"\n"
+    error_record.system_out = SpooledText(["<spooled>\n", "& more"])
+    for record_ in (passed_record, failed_record, error_record):
+        direct_output = []
+        element_output = []
+        DirectSerializer().write_record(direct_output.append, record_, 1)
+        DirectSerializer().write_element(
+            element_output.append, record_.to_element(), 1
+        )
+        assert b"".join(direct_output) == b"".join(element_output)
+        ET.fromstring(b"".join(direct_output))
+
+
+def test_plugin_import_is_lazy():
+    completed_process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "import pytest_junit_xray_xml.plugin"
+        ],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    imported_modules = {
+        line_.rsplit("|", 1)[-1].strip()
+        for line_ in completed_process.stderr.splitlines()
+        if line_.startswith("import time:")
+    }
+    assert "pytest_junit_xray_xml.plugin" in imported_modules
+    for module_ in ("junit_xml_xray_xml", "writers", "serializers",
+                    "evidence", "fixtures", "distributed"):
+        assert f"pytest_junit_xray_xml.{module_}" not in imported_modules
+
+
+def test_fixtures_are_importable_from_package():
+    import pytest_junit_xray_xml
+
+    assert pytest_junit_xray_xml.record_test_key is not None
+    with pytest.raises(AttributeError):
+        pytest_junit_xray_xml.record_test_unknown